@@ -0,0 +1,198 @@
+"""Admission control: bounded concurrency per route class, shedding the rest.
+
+Requests are sorted into classes (quick reads, writes that queue up behind
+the commit writer, bulk transfers, long-lived event streams). Each class
+may run ``limit`` requests at once and let ``queue`` more wait up to
+``wait`` seconds for a slot; anything beyond that is answered straight away
+with 503 and a Retry-After header instead of tying up a server thread. So
+when writes back up behind a slow commit, only the write class fills up
+and reads keep their threads.
+
+Limits are per worker process. APEX_ADMISSION holds them as
+``class=limit/queue`` pairs (``read=16/16,write=4/4``), or ``auto`` to size
+every class from the thread count; unset or ``off`` admits everything,
+which is what the single-process dev server does.
+"""
+import json
+import os
+import threading
+import time
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+from werkzeug.wsgi import ClosingIterator
+
+from metrics import ADMISSION_REJECTED, ADMISSION_WAIT_SECONDS
+
+# Server threads per worker process, which the automatic limits divide up
+DEFAULT_THREADS = int(os.environ.get('APEX_THREADS', 16))
+# Longest a queued request waits for a slot before it is shed
+DEFAULT_WAIT = float(os.environ.get('APEX_ADMISSION_WAIT_MS', 500)) / 1000
+
+# class -> seconds clients are told to wait before retrying
+RETRY_AFTER = {'read': 1, 'write': 2, 'bulk': 10, 'stream': 5}
+
+
+def default_limits(threads: int) -> Dict[str, Tuple[int, int]]:
+    """class -> (limit, queue) sized for ``threads`` server threads. Writes,
+    bulk transfers and streams together can never hold every thread, so
+    some are always left for reads."""
+    quarter = max(1, threads // 4)
+    return {
+        'read': (threads, threads),
+        'write': (quarter, quarter),
+        'bulk': (1, 1),
+        'stream': (quarter, 0),
+    }
+
+
+def parse_limits(spec: str) -> Dict[str, Tuple[int, int]]:
+    """'read=16/16,write=4/4' -> {'read': (16, 16), 'write': (4, 4)}"""
+    limits = {}
+    for part in spec.split(','):
+        if not part.strip():
+            continue
+        name, _, value = part.partition('=')
+        limit, _, queue = value.partition('/')
+        try:
+            limit, queue = int(limit), int(queue or 0)
+        except ValueError:
+            limit = queue = -1
+        if limit < 1 or queue < 0:
+            raise ValueError(f'Invalid admission limit: {part.strip()} (expected class=limit/queue)')
+        limits[name.strip()] = (limit, queue)
+    return limits
+
+
+def limits_from_env(threads: int = DEFAULT_THREADS) -> Optional[Dict[str, Tuple[int, int]]]:
+    """Limits configured by APEX_ADMISSION, None when admission control is off"""
+    spec = os.environ.get('APEX_ADMISSION', '').strip()
+    if not spec or spec == 'off':
+        return None
+    if spec == 'auto':
+        return default_limits(threads)
+    return {**default_limits(threads), **parse_limits(spec)}
+
+
+class Gate:
+    """At most ``limit`` requests inside, at most ``queue`` more waiting"""
+
+    def __init__(self, name: str, limit: int, queue: int):
+        self.name = name
+        self.limit = limit
+        self.queue = queue
+        self.active = 0
+        self.waiting = 0
+        self._cond = threading.Condition()
+
+    def enter(self, wait: float) -> Optional[str]:
+        """Take a slot, waiting up to ``wait`` seconds for one. Returns None
+        once admitted, else why not ('queue_full' or 'timeout')."""
+        with self._cond:
+            if self.active < self.limit:
+                self.active += 1
+                return None
+            if self.waiting >= self.queue:
+                return 'queue_full'
+            self.waiting += 1
+            started = time.perf_counter()
+            deadline = time.monotonic() + wait
+            try:
+                while self.active >= self.limit:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 or not self._cond.wait(remaining):
+                        if self.active >= self.limit:
+                            return 'timeout'
+                self.active += 1
+            finally:
+                self.waiting -= 1
+                ADMISSION_WAIT_SECONDS.observe(time.perf_counter() - started, route_class=self.name)
+            return None
+
+    def leave(self):
+        with self._cond:
+            self.active -= 1
+            self._cond.notify()
+
+
+class AdmissionControl:
+    """WSGI middleware admitting each request through its class's Gate
+
+    ``classify(environ)`` names the class of a request; None lets it
+    through unconditionally (health checks, metrics). A slot is held until
+    the response has been sent, streamed bodies included.
+    """
+
+    def __init__(self, limits: Dict[str, Tuple[int, int]],
+                 classify: Callable[[dict], Optional[str]], wait: float = DEFAULT_WAIT):
+        self.gates = {name: Gate(name, limit, queue) for name, (limit, queue) in limits.items()}
+        self.classify = classify
+        self.wait = wait
+        self.draining = False
+
+    def wrap(self, wsgi_app):
+        def admit(environ, start_response):
+            gate = self.gates.get(self.classify(environ))
+            if gate is None:
+                return wsgi_app(environ, start_response)
+            reason = 'draining' if self.draining else gate.enter(self.wait)
+            if reason is not None:
+                ADMISSION_REJECTED.inc(route_class=gate.name, reason=reason)
+                return shed(gate.name, start_response)
+            try:
+                body = wsgi_app(environ, start_response)
+            except BaseException:
+                gate.leave()
+                raise
+            file_wrapper = environ.get('wsgi.file_wrapper')
+            if isinstance(file_wrapper, type) and isinstance(body, file_wrapper):
+                # The server only uses sendfile() for its own wrapper, so
+                # hand that back and release the slot when it is closed
+                body.close = _then(getattr(body, 'close', None), gate.leave)
+                return body
+            return ClosingIterator(body, gate.leave)
+        return admit
+
+    def drain(self):
+        """Shed every request from now on, e.g. while shutting down"""
+        self.draining = True
+
+    def in_flight(self) -> int:
+        return sum(gate.active for gate in self.gates.values())
+
+    def wait_idle(self, timeout: float) -> bool:
+        """Wait up to ``timeout`` seconds for admitted requests to finish"""
+        deadline = time.monotonic() + timeout
+        while self.in_flight():
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+
+def _then(close: Optional[Callable[[], None]], after: Callable[[], None]) -> Callable[[], None]:
+    """close(), if any, followed by after() even when close() fails"""
+    def closing():
+        try:
+            if close is not None:
+                close()
+        finally:
+            after()
+    return closing
+
+
+def shed(route_class: str, start_response) -> Iterable[bytes]:
+    """Response turning a request away for now"""
+    retry_after = RETRY_AFTER.get(route_class, 1)
+    if route_class == 'stream':
+        # EventSource gives up for good on any status but 200, so tell it
+        # when to reconnect in the stream itself
+        start_response('200 OK', [('Content-Type', 'text/event-stream'),
+                                  ('Cache-Control', 'no-cache'),
+                                  ('Access-Control-Allow-Origin', '*')])
+        return [f'retry: {retry_after * 1000}\n\n'.encode()]
+    body = json.dumps({'error': 'Server busy, try again shortly'}).encode()
+    start_response('503 Service Unavailable', [('Content-Type', 'application/json'),
+                                               ('Content-Length', str(len(body))),
+                                               ('Retry-After', str(retry_after)),
+                                               ('Access-Control-Allow-Origin', '*')])
+    return [body]
@@ -0,0 +1,109 @@
+"""Job counts and pay totals kept current as jobs change.
+
+Dashboards used to download every job and add them up in the browser.
+JobStats registers as a jobs_table listener instead: each row change
+subtracts the old row's contribution and adds the new one, and a full
+reload of the table rebuilds the counters from scratch. Reading the stats
+costs O(groups), however many jobs there are.
+"""
+import threading
+from collections import Counter
+from typing import Dict, List, Optional
+
+from values import parse_number
+
+
+class JobStats:
+    """Counters over the jobs table, grouped by status, trade, city and contractor"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.total = 0
+        self.by_status: Counter = Counter()
+        self.by_trade: Counter = Counter()
+        self.by_city: Counter = Counter()
+        self.pay_by_status: Dict[str, float] = {}
+        self.unpriced = 0  # jobs whose estimatedPay isn't a number
+        self.unassigned = 0
+        # contractorId -> Counter of statuses of the jobs assigned to them
+        self.by_contractor: Dict[str, Counter] = {}
+
+    # ---------- table listener ----------
+
+    def on_change(self, old: Optional[Dict], new: Optional[Dict]):
+        """Move one row's contribution from ``old`` to ``new``"""
+        with self._lock:
+            if old is not None:
+                self._count(old, -1)
+            if new is not None:
+                self._count(new, 1)
+
+    def on_reload(self, rows: List[Dict]):
+        """Recount everything after the table was rebuilt"""
+        with self._lock:
+            self._reset()
+            for row in rows:
+                self._count(row, 1)
+
+    def _count(self, job: Dict, sign: int):
+        status = job.get('status', '')
+        self.total += sign
+        _bump(self.by_status, status, sign)
+        _bump(self.by_trade, job.get('trade', ''), sign)
+        _bump(self.by_city, job.get('city', ''), sign)
+
+        pay = parse_number(job.get('estimatedPay'))
+        if pay is None:
+            self.unpriced += sign
+        else:
+            total = self.pay_by_status.get(status, 0.0) + sign * pay
+            if self.by_status.get(status):
+                self.pay_by_status[status] = total
+            else:
+                self.pay_by_status.pop(status, None)
+
+        contractor_id = job.get('assignedContractorId', '')
+        if not contractor_id:
+            self.unassigned += sign
+        else:
+            statuses = self.by_contractor.setdefault(contractor_id, Counter())
+            _bump(statuses, status, sign)
+            if not statuses:
+                del self.by_contractor[contractor_id]
+
+    # ---------- reading ----------
+
+    def snapshot(self, contractor_id: Optional[str] = None) -> Dict:
+        """Current counters as JSON-ready dicts; ``contractor_id`` limits
+        the per-contractor breakdown to one contractor"""
+        with self._lock:
+            if contractor_id is None:
+                contractors = self.by_contractor.items()
+            else:
+                contractors = [(contractor_id, self.by_contractor.get(contractor_id, Counter()))]
+            return {
+                'total': self.total,
+                'byStatus': dict(self.by_status),
+                'byTrade': dict(self.by_trade),
+                'byCity': dict(self.by_city),
+                'estimatedPayByStatus': {s: round(v, 2) for s, v in self.pay_by_status.items()},
+                'unpriced': self.unpriced,
+                'assigned': self.total - self.unassigned,
+                'unassigned': self.unassigned,
+                'byContractor': {
+                    cid: {'total': sum(statuses.values()), 'byStatus': dict(statuses)}
+                    for cid, statuses in contractors
+                },
+            }
+
+
+def _bump(counter: Counter, key: str, sign: int):
+    """Add ``sign`` to ``counter[key]``, dropping keys that reach zero"""
+    value = counter.get(key, 0) + sign
+    if value:
+        counter[key] = value
+    else:
+        counter.pop(key, None)
@@ -0,0 +1,225 @@
+"""Cold tier for rows that are done with, kept as compressed segments.
+
+Finished jobs stay interesting for years but are almost never read, and
+while they sit in the resident jobs table every reload, snapshot rewrite
+and index pays for them. A SegmentArchive holds such rows instead, as
+gzip-compressed CSV segments partitioned by month of last activity::
+
+    archive/jobs-2025-03.csv.gz
+
+Adding rows to a month rewrites its segment whole (temp file, fsync,
+rename), so readers in any process only ever see complete segments; a row
+archived again into another month is then dropped from its old one. The
+archive is read only when asked for: the first lookup in a process indexes
+which segment holds each key, and segments written since, by this process
+or another, are re-indexed when their file signature changes. A few
+decoded segments are kept in memory for repeated lookups.
+"""
+import csv
+import gzip
+import io
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Set
+
+from store import file_signature
+from values import parse_timestamp
+
+# Statuses a job never leaves, and how long it must sit idle in one of
+# them before it is archived
+DEFAULT_STATUSES = tuple(s.strip() for s in os.environ.get('APEX_ARCHIVE_STATUSES', 'Paid,Declined').split(',')
+                         if s.strip())
+DEFAULT_AFTER_DAYS = float(os.environ.get('APEX_ARCHIVE_AFTER_DAYS', 180))
+# Seconds between background archiving passes; 0 turns them off
+DEFAULT_INTERVAL = float(os.environ.get('APEX_ARCHIVE_INTERVAL_S', 3600))
+DEFAULT_CACHED_SEGMENTS = 4
+SEGMENT_SUFFIX = '.csv.gz'
+
+# Columns whose latest timestamp is when a job was last active
+ACTIVITY_FIELDS = ('contractorProgress_lastUpdated', 'scheduledTime', 'createdAt')
+
+
+def last_activity(row) -> Optional[float]:
+    """POSIX time of the latest activity timestamp of a job, None if it has none"""
+    times = [t for t in (parse_timestamp(row.get(f)) for f in ACTIVITY_FIELDS) if t is not None]
+    return max(times) if times else None
+
+
+class SegmentArchive:
+    """Rows of one table in monthly gzip CSV segments under ``directory``
+
+    ``timestamp`` gives the POSIX time that decides a row's segment; rows
+    without one can't be archived.
+    """
+
+    def __init__(self, directory: str, name: str, fieldnames: Sequence[str], key: str,
+                 timestamp: Callable[[Dict], Optional[float]] = last_activity,
+                 cached_segments: int = DEFAULT_CACHED_SEGMENTS):
+        self.directory = directory
+        self.name = name
+        self.fieldnames = list(fieldnames)
+        self.key = key
+        self.timestamp = timestamp
+        self.cached_segments = cached_segments
+        self._lock = threading.RLock()
+        # key -> segment holding it, for every segment in _indexed
+        self._where: Dict[str, str] = {}
+        self._keys: Dict[str, Set[str]] = {}  # segment -> keys it holds
+        self._indexed: Dict[str, object] = {}  # segment -> signature indexed
+        # segment -> (signature, {key: row}), least recently used first
+        self._cache: OrderedDict = OrderedDict()
+
+    def segment_for(self, row) -> str:
+        """Segment a row belongs in; ValueError if it has no timestamp"""
+        at = self.timestamp(row)
+        if at is None:
+            raise ValueError(f'No timestamp to archive {row.get(self.key)} by')
+        month = datetime.fromtimestamp(at, timezone.utc).strftime('%Y-%m')
+        return f'{self.name}-{month}{SEGMENT_SUFFIX}'
+
+    def segments(self) -> Dict[str, object]:
+        """Segment file name -> file signature, oldest month first"""
+        try:
+            names = sorted(n for n in os.listdir(self.directory)
+                           if n.startswith(f'{self.name}-') and n.endswith(SEGMENT_SUFFIX))
+        except FileNotFoundError:
+            return {}
+        return {n: file_signature(os.path.join(self.directory, n)) for n in names}
+
+    def version(self) -> tuple:
+        """Changes whenever any segment is written, in any process"""
+        return tuple(self.segments().items())
+
+    # ---------- reading ----------
+
+    def get(self, key: str) -> Optional[Dict]:
+        """The archived row with primary key ``key``"""
+        with self._lock:
+            self._sync()
+            segment = self._where.get(key)
+            return None if segment is None else self._read(segment).get(key)
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            self._sync()
+            return key in self._where
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._sync()
+            return len(self._where)
+
+    def rows(self) -> Iterator[Dict]:
+        """Every archived row, segment by segment (oldest month first).
+        A key left in two segments by an interrupted move only comes from
+        the one it is indexed in."""
+        with self._lock:
+            self._sync()
+            segments = list(self._indexed)
+        for segment in sorted(segments):
+            with self._lock:
+                where = self._where
+                rows = [row for key, row in self._read(segment).items() if where.get(key) == segment]
+            yield from rows
+
+    def _sync(self):
+        """Index the keys of segments written since we last looked"""
+        affected = set()
+        for segment, signature in self.segments().items():
+            if self._indexed.get(segment) != signature:
+                keys = set(self._read(segment))
+                # Keys may have moved out of the segment as well as into it
+                affected |= keys ^ self._keys.get(segment, set())
+                self._keys[segment] = keys
+                self._indexed[segment] = signature
+        gone = set(affected)
+        # Later months go last, so a key in two segments (a move cut short)
+        # is indexed in the later one
+        for segment in sorted(self._keys):
+            for key in self._keys[segment] & affected:
+                self._where[key] = segment
+                gone.discard(key)
+        for key in gone:
+            del self._where[key]
+
+    def _read(self, segment: str) -> Dict[str, Dict]:
+        """Rows of one segment by key, decoded at most once per version"""
+        path = os.path.join(self.directory, segment)
+        signature = file_signature(path)
+        cached = self._cache.get(segment)
+        if cached is not None and cached[0] == signature:
+            self._cache.move_to_end(segment)
+            return cached[1]
+        if signature is None:
+            return {}
+        with gzip.open(path, 'rt', newline='') as f:
+            rows = {r[self.key]: r for r in csv.DictReader(f)}
+        self._remember(segment, signature, rows)
+        return rows
+
+    def _remember(self, segment: str, signature, rows: Dict[str, Dict]):
+        self._cache[segment] = (signature, rows)
+        self._cache.move_to_end(segment)
+        while len(self._cache) > self.cached_segments:
+            self._cache.popitem(last=False)
+
+    # ---------- writing ----------
+
+    def add(self, rows: Iterable[Dict]) -> List[str]:
+        """Durably archive ``rows``, replacing earlier copies with the same
+        key; returns the segments written. Callers hold the storage writer
+        lock so no other process rewrites the same segments meanwhile."""
+        by_segment: Dict[str, List[Dict]] = {}
+        for row in rows:
+            by_segment.setdefault(self.segment_for(row), []).append(row)
+        if not by_segment:
+            return []
+        os.makedirs(self.directory, exist_ok=True)
+        with self._lock:
+            self._sync()
+            moved: Dict[str, List[str]] = {}  # older segment -> keys now elsewhere
+            for segment, new_rows in by_segment.items():
+                merged = dict(self._read(segment))
+                merged.update((row[self.key], {f: row.get(f, '') for f in self.fieldnames}) for row in new_rows)
+                self._save(segment, merged)
+                for row in new_rows:
+                    key = row[self.key]
+                    previous = self._where.get(key)
+                    if previous is not None and previous != segment:
+                        moved.setdefault(previous, []).append(key)
+                    self._where[key] = segment
+            # Only after the new copies are durable, so a crash leaves two
+            # copies rather than none
+            for segment, keys in moved.items():
+                rows = dict(self._read(segment))
+                for key in keys:
+                    rows.pop(key, None)
+                self._save(segment, rows)
+        return list(by_segment)
+
+    def _save(self, segment: str, rows: Dict[str, Dict]):
+        """Write a whole segment and record it as cached and indexed"""
+        signature = self._write(segment, rows)
+        self._remember(segment, signature, rows)
+        self._keys[segment] = set(rows)
+        self._indexed[segment] = signature
+
+    def _write(self, segment: str, rows: Dict[str, Dict]):
+        """Replace a segment atomically: write a temp file, fsync, rename.
+        Returns the new file signature."""
+        path = os.path.join(self.directory, segment)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as raw:
+            with gzip.GzipFile(fileobj=raw, mode='wb') as compressed:
+                text = io.TextIOWrapper(compressed, encoding='utf-8', newline='')
+                writer = csv.DictWriter(text, fieldnames=self.fieldnames)
+                writer.writeheader()
+                writer.writerows(rows.values())
+                text.flush()
+                text.detach()
+            raw.flush()
+            os.fsync(raw.fileno())
+        os.replace(tmp_path, path)
+        return file_signature(path)
@@ -0,0 +1,492 @@
+"""Load-testing harness for the API.
+
+Builds a synthetic data set, starts the app against a private copy of it and
+fires a weighted mix of requests from several threads, either straight into
+the WSGI app (inprocess) or over HTTP to a local server (socket). Reports
+throughput and p50/p95/p99 latency per route and saves them as JSON:
+
+    python bench.py run --rows 100000 --driver socket --out before.json
+    python bench.py run --rows 100000 --driver socket --out after.json
+    python bench.py compare before.json after.json
+
+Data sets are cached under ``bench-data/`` and generated from a fixed seed,
+so two runs with the same arguments see the same rows.
+"""
+import argparse
+import csv
+import http.client
+import json
+import logging
+import math
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+from storage import AGREEMENT_FIELDS, JOB_FIELDS, KYC_FIELDS, PROFILE_FIELDS, TABLES
+
+SIZES = {'1k': 1_000, '100k': 100_000, '1m': 1_000_000}
+DEFAULT_MIX = 'login=20,list_jobs=40,update_job=20,assign_job=10,sign_agreement=10'
+STATUSES = ['Open', 'InProgress', 'Complete', 'Paid']
+TRADES = ['Plumbing', 'Electrical', 'Roofing', 'HVAC', 'Painting', 'Flooring']
+CITIES = ['Austin', 'Dallas', 'Houston', 'Denver', 'Phoenix', 'Tampa']
+AGREEMENTS = ['independent-contractor', 'code-of-conduct', 'safety-policy']
+PASSWORD = 'bench123'
+
+# ==================== DATA SETS ====================
+
+class Dataset:
+    """Shape of a generated data set; ids are derived, not stored"""
+
+    def __init__(self, rows: int, seed: int = 42):
+        self.rows = rows
+        self.seed = seed
+        self.profiles = max(rows // 10, 10)
+        # A third of the profiles post jobs, the rest take them
+        self.customers = max(self.profiles // 3, 1)
+        self.contractors = self.profiles - self.customers
+
+    def customer_id(self, i: int) -> str:
+        return f'customer-{i:07d}'
+
+    def contractor_id(self, i: int) -> str:
+        return f'contractor-{i:07d}'
+
+    def job_id(self, i: int) -> str:
+        return f'job-{i:08d}'
+
+    def email(self, profile_id: str) -> str:
+        return f'{profile_id}@bench.test'
+
+
+def generate(dataset: Dataset, directory: str):
+    """Write the four CSV tables for ``dataset`` into ``directory``"""
+    os.makedirs(directory, exist_ok=True)
+    rng = random.Random(dataset.seed)
+    start = datetime(2024, 1, 1)
+
+    def write(table: str, fieldnames: List[str], rows):
+        with open(os.path.join(directory, TABLES[table].csv_path), 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=fieldnames)
+            writer.writeheader()
+            writer.writerows(rows)
+
+    def profiles():
+        for i in range(dataset.customers):
+            pid = dataset.customer_id(i)
+            yield {'profileID': pid, 'email': dataset.email(pid), 'password': PASSWORD, 'user_role': 'customer'}
+        for i in range(dataset.contractors):
+            pid = dataset.contractor_id(i)
+            yield {'profileID': pid, 'email': dataset.email(pid), 'password': PASSWORD, 'user_role': 'contractor'}
+
+    def jobs():
+        for i in range(dataset.rows):
+            status = rng.choice(STATUSES)
+            assigned = '' if status == 'Open' else dataset.contractor_id(rng.randrange(dataset.contractors))
+            created = start + timedelta(seconds=i * 30)
+            yield {
+                'jobID': dataset.job_id(i),
+                'profileID': dataset.customer_id(rng.randrange(dataset.customers)),
+                'jobName': f'{rng.choice(TRADES)} job {i}',
+                'propertyAddress': f'{rng.randrange(1, 9999)} Main St',
+                'city': rng.choice(CITIES),
+                'customerName': f'Customer {i}',
+                'customerEmail': f'customer{i}@bench.test',
+                'trade': rng.choice(TRADES),
+                'estimatedPay': str(rng.randrange(100, 20000)),
+                'description': 'Synthetic benchmark job',
+                'scheduledTime': (created + timedelta(days=rng.randrange(1, 60))).isoformat(),
+                'squareFootage': str(rng.randrange(200, 8000)),
+                'status': status,
+                'assignedContractorId': assigned,
+                'materialStatus': rng.choice(['', 'Ordered', 'Delivered']),
+                'createdAt': created.isoformat(),
+                'contractorProgress_currentStep': '1' if assigned else '',
+                'contractorProgress_acknowledged': 'False' if assigned else '',
+                'contractorProgress_lastUpdated': created.isoformat() if assigned else '',
+            }
+
+    def kyc():
+        for i in range(dataset.contractors):
+            yield {
+                'contractorId': dataset.contractor_id(i),
+                'idPhotoUrl': '', 'selfieUrl': '',
+                'status': rng.choice(['pending', 'verified']),
+                'submittedAt': start.isoformat(), 'verifiedAt': '',
+            }
+
+    def agreements():
+        for i in range(dataset.contractors):
+            for agreement_id in AGREEMENTS[:2]:
+                yield {
+                    'contractorId': dataset.contractor_id(i), 'agreementId': agreement_id,
+                    'version': '1.0', 'signedName': f'Contractor {i}', 'signedAt': start.isoformat(),
+                }
+
+    write('profiles', PROFILE_FIELDS, profiles())
+    write('jobs', JOB_FIELDS, jobs())
+    write('kyc', KYC_FIELDS, kyc())
+    write('agreements', AGREEMENT_FIELDS, agreements())
+
+
+def cached_dataset(dataset: Dataset, cache_dir: str) -> str:
+    """Directory holding ``dataset``, generating it on first use"""
+    directory = os.path.join(cache_dir, f'{dataset.rows}-{dataset.seed}')
+    marker = os.path.join(directory, '.complete')
+    if not os.path.exists(marker):
+        print(f'Generating {dataset.rows} jobs into {directory}...', file=sys.stderr)
+        generate(dataset, directory)
+        open(marker, 'w').close()
+    return directory
+
+# ==================== REQUEST MIX ====================
+
+# (method, path, json body)
+Request = Tuple[str, str, Optional[Dict]]
+
+
+def request_factories(dataset: Dataset) -> Dict[str, Callable[[random.Random], Request]]:
+    """One request builder per benchmarked route"""
+
+    def login(rng):
+        pid = dataset.contractor_id(rng.randrange(dataset.contractors))
+        return 'POST', '/api/login', {'email': dataset.email(pid), 'password': PASSWORD}
+
+    def list_jobs(rng):
+        choice = rng.randrange(4)
+        if choice == 0:
+            query = f'status={rng.choice(STATUSES)}'
+        elif choice == 1:
+            query = f'profileID={dataset.customer_id(rng.randrange(dataset.customers))}'
+        elif choice == 2:
+            query = f'assignedContractorId={dataset.contractor_id(rng.randrange(dataset.contractors))}'
+        else:
+            query = f'status=Open&trade={rng.choice(TRADES)}&sort=-estimatedPay'
+        return 'GET', f'/api/jobs?{query}&limit=100', None
+
+    def job_stats(rng):
+        return 'GET', '/api/jobs/stats', None
+
+    def compliance_status(rng):
+        ids = [dataset.contractor_id(rng.randrange(dataset.contractors)) for _ in range(200)]
+        return 'POST', '/api/compliance/status', {'contractorIds': ids}
+
+    def update_job(rng):
+        job_id = dataset.job_id(rng.randrange(dataset.rows))
+        return 'PUT', f'/api/jobs/{job_id}', {'materialStatus': rng.choice(['Ordered', 'Delivered', 'Backordered'])}
+
+    def assign_job(rng):
+        job_id = dataset.job_id(rng.randrange(dataset.rows))
+        return 'POST', f'/api/jobs/{job_id}/assign', {'contractorId': dataset.contractor_id(rng.randrange(dataset.contractors))}
+
+    def sign_agreement(rng):
+        i = rng.randrange(dataset.contractors)
+        return 'POST', '/api/agreements/sign', {
+            'contractorId': dataset.contractor_id(i), 'agreementId': rng.choice(AGREEMENTS),
+            'version': '1.0', 'signedName': f'Contractor {i}',
+        }
+
+    return {
+        'login': login,
+        'list_jobs': list_jobs,
+        'job_stats': job_stats,
+        'compliance_status': compliance_status,
+        'update_job': update_job,
+        'assign_job': assign_job,
+        'sign_agreement': sign_agreement,
+    }
+
+
+def parse_mix(spec: str, known) -> Dict[str, float]:
+    """'login=20,list_jobs=40' -> {'login': 20.0, 'list_jobs': 40.0}"""
+    mix = {}
+    for part in filter(None, (p.strip() for p in spec.split(','))):
+        name, _, weight = part.partition('=')
+        if name not in known:
+            raise SystemExit(f'Unknown route in mix: {name} (choose from {", ".join(known)})')
+        mix[name] = float(weight or 1)
+    return mix
+
+# ==================== DRIVERS ====================
+
+class InProcessDriver:
+    """Calls the WSGI app directly through Flask's test client"""
+
+    name = 'inprocess'
+
+    def __init__(self, app):
+        self.app = app
+
+    def client(self):
+        test_client = self.app.test_client()
+
+        def send(method: str, path: str, body: Optional[Dict]) -> int:
+            return test_client.open(path, method=method, json=body).status_code
+        return send
+
+    def close(self):
+        pass
+
+
+class SocketDriver:
+    """Serves the app on a local port and talks HTTP to it"""
+
+    name = 'socket'
+
+    def __init__(self, app):
+        from werkzeug.serving import make_server
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)  # no per-request access log
+        self.server = make_server('127.0.0.1', 0, app, threaded=True)
+        self.port = self.server.server_port
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def client(self):
+        conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=60)
+
+        def send(method: str, path: str, body: Optional[Dict]) -> int:
+            payload = None if body is None else json.dumps(body)
+            headers = {} if body is None else {'Content-Type': 'application/json'}
+            conn.request(method, path, body=payload, headers=headers)
+            response = conn.getresponse()
+            response.read()
+            return response.status
+        return send
+
+    def close(self):
+        self.server.shutdown()
+
+
+DRIVERS = {'inprocess': InProcessDriver, 'socket': SocketDriver}
+
+# ==================== RUNNING ====================
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(math.ceil(pct / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+def summarize(latencies: List[float], errors: int, elapsed: float) -> Dict:
+    values = sorted(latencies)
+    return {
+        'requests': len(values),
+        'errors': errors,
+        'throughput_rps': round(len(values) / elapsed, 1) if elapsed else 0.0,
+        'mean_ms': round(sum(values) / len(values) * 1000, 3) if values else 0.0,
+        'p50_ms': round(percentile(values, 50) * 1000, 3),
+        'p95_ms': round(percentile(values, 95) * 1000, 3),
+        'p99_ms': round(percentile(values, 99) * 1000, 3),
+        'max_ms': round(values[-1] * 1000, 3) if values else 0.0,
+    }
+
+
+def drive(driver, factories, mix: Dict[str, float], requests: int, threads: int,
+          warmup: int, seed: int) -> Tuple[Dict[str, Dict], Dict, float]:
+    """Fire ``requests`` requests from ``threads`` threads; returns
+    (per-route summaries, overall summary, elapsed seconds)"""
+    names = list(mix)
+    weights = [mix[n] for n in names]
+    results = {name: ([], [0]) for name in names}  # latencies, [errors]
+    results_lock = threading.Lock()
+    per_thread = [requests // threads + (1 if i < requests % threads else 0) for i in range(threads)]
+    barrier = threading.Barrier(threads + 1)
+
+    def worker(index: int, count: int):
+        rng = random.Random(seed * 1000 + index)
+        send = driver.client()
+        for _ in range(warmup):
+            send(*factories[rng.choices(names, weights)[0]](rng))
+        local = {name: ([], [0]) for name in names}
+        barrier.wait()
+        for _ in range(count):
+            name = rng.choices(names, weights)[0]
+            request = factories[name](rng)
+            start = time.perf_counter()
+            try:
+                status = send(*request)
+            except Exception:
+                status = 599
+            local[name][0].append(time.perf_counter() - start)
+            if status >= 400:
+                local[name][1][0] += 1
+        with results_lock:
+            for name, (latencies, errors) in local.items():
+                results[name][0].extend(latencies)
+                results[name][1][0] += errors[0]
+
+    workers = [threading.Thread(target=worker, args=(i, n), daemon=True) for i, n in enumerate(per_thread)]
+    for w in workers:
+        w.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - started
+
+    routes = {name: summarize(latencies, errors[0], elapsed) for name, (latencies, errors) in results.items()}
+    everything = [latency for latencies, _ in results.values() for latency in latencies]
+    total_errors = sum(errors[0] for _, errors in results.values())
+    return routes, summarize(everything, total_errors, elapsed), elapsed
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return ''
+
+
+def run(args) -> Dict:
+    dataset = Dataset(SIZES.get(args.size, 0) or args.rows, seed=args.seed)
+    source = cached_dataset(dataset, args.cache_dir)
+
+    # Mutating routes change the data: every run starts from a fresh copy
+    workdir = tempfile.mkdtemp(prefix='apex-bench-')
+    try:
+        for name in os.listdir(source):
+            if name.endswith('.csv'):
+                shutil.copy(os.path.join(source, name), workdir)
+        os.environ['APEX_STORAGE'] = args.storage
+        os.environ['APEX_DATA_DIR'] = workdir
+        os.environ['APEX_SQLITE_PATH'] = os.path.join(workdir, 'apex.db')
+        os.environ['APEX_UPLOAD_DIR'] = os.path.join(workdir, 'uploads')
+        os.environ['APEX_ARCHIVE_DIR'] = os.path.join(workdir, 'archive')
+        if args.storage == 'sqlite':
+            from storage import CsvBackend, SqliteBackend, import_csv
+            import_csv(CsvBackend(workdir), SqliteBackend(os.environ['APEX_SQLITE_PATH']))
+
+        # Importing main opens the storage selected above; time it together
+        # with the first full load of the resident tables
+        started = time.perf_counter()
+        import main
+        main.warm_up()
+        startup = time.perf_counter() - started
+
+        factories = request_factories(dataset)
+        mix = parse_mix(args.mix, factories)
+        driver = DRIVERS[args.driver](main.app)
+        try:
+            routes, total, elapsed = drive(driver, factories, mix, args.requests,
+                                           args.threads, args.warmup, args.seed)
+        finally:
+            driver.close()
+            main.commits.close()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'rows': dataset.rows,
+            'profiles': dataset.profiles,
+            'seed': dataset.seed,
+            'storage': args.storage,
+            'driver': args.driver,
+            'threads': args.threads,
+            'requests': args.requests,
+            'mix': mix,
+        },
+        'startup_ms': round(startup * 1000, 1),
+        'elapsed_s': round(elapsed, 3),
+        'total': total,
+        'routes': routes,
+    }
+
+
+def print_report(result: Dict):
+    meta = result['meta']
+    print(f"{meta['rows']} jobs, {meta['storage']} storage, {meta['driver']} driver, "
+          f"{meta['threads']} threads; startup {result['startup_ms']} ms")
+    print(f"{'route':<16}{'reqs':>8}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, stats in list(result['routes'].items()) + [('total', result['total'])]:
+        print(f"{name:<16}{stats['requests']:>8}{stats['errors']:>8}{stats['throughput_rps']:>10}"
+              f"{stats['p50_ms']:>10}{stats['p95_ms']:>10}{stats['p99_ms']:>10}")
+
+
+def compare(base: Dict, new: Dict, threshold: float) -> bool:
+    """Print per-route changes; True if any p95 or throughput regressed
+    by more than ``threshold`` percent"""
+    regressed = False
+    for field in ('rows', 'storage', 'driver', 'threads', 'mix'):
+        if base['meta'].get(field) != new['meta'].get(field):
+            print(f"Note: {field} differs ({base['meta'].get(field)} vs {new['meta'].get(field)})")
+
+    def change(old: float, new: float) -> float:
+        return (new - old) / old * 100 if old else 0.0
+
+    print(f"{'route':<16}{'p95 ms':>22}{'change':>9}{'req/s':>22}{'change':>9}")
+    routes = list(new['routes'].items()) + [('total', new['total'])]
+    for name, stats in routes:
+        old = base['total'] if name == 'total' else base['routes'].get(name)
+        if old is None:
+            continue
+        p95 = change(old['p95_ms'], stats['p95_ms'])
+        rps = change(old['throughput_rps'], stats['throughput_rps'])
+        flag = ''
+        if p95 > threshold or rps < -threshold:
+            regressed = True
+            flag = '  REGRESSION'
+        print(f"{name:<16}{old['p95_ms']:>10} -> {stats['p95_ms']:<8}{p95:>+8.1f}%"
+              f"{old['throughput_rps']:>10} -> {stats['throughput_rps']:<8}{rps:>+8.1f}%{flag}")
+    return regressed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Apex portal API benchmarks')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    gen_cmd = sub.add_parser('generate', help='Write a synthetic data set')
+    gen_cmd.add_argument('--size', choices=SIZES, help='Preset number of jobs')
+    gen_cmd.add_argument('--rows', type=int, default=1_000, help='Number of jobs (profiles are a tenth of that)')
+    gen_cmd.add_argument('--seed', type=int, default=42)
+    gen_cmd.add_argument('--dir', required=True, help='Directory to write the CSV files to')
+
+    run_cmd = sub.add_parser('run', help='Benchmark the API against a synthetic data set')
+    run_cmd.add_argument('--size', choices=SIZES, help='Preset number of jobs')
+    run_cmd.add_argument('--rows', type=int, default=1_000, help='Number of jobs (profiles are a tenth of that)')
+    run_cmd.add_argument('--seed', type=int, default=42)
+    run_cmd.add_argument('--storage', choices=['csv', 'sqlite'], default='csv')
+    run_cmd.add_argument('--driver', choices=DRIVERS, default='inprocess')
+    run_cmd.add_argument('--mix', default=DEFAULT_MIX, help=f'Route weights (default {DEFAULT_MIX})')
+    run_cmd.add_argument('--requests', type=int, default=5_000, help='Measured requests in total')
+    run_cmd.add_argument('--threads', type=int, default=4)
+    run_cmd.add_argument('--warmup', type=int, default=20, help='Unmeasured requests per thread')
+    run_cmd.add_argument('--cache-dir', default='bench-data', help='Where generated data sets are kept')
+    run_cmd.add_argument('--out', help='Write the results as JSON to this file')
+
+    cmp_cmd = sub.add_parser('compare', help='Compare two result files')
+    cmp_cmd.add_argument('base')
+    cmp_cmd.add_argument('new')
+    cmp_cmd.add_argument('--threshold', type=float, default=10.0,
+                         help='Percent change in p95 or throughput counted as a regression')
+
+    args = parser.parse_args()
+
+    if args.command == 'generate':
+        generate(Dataset(SIZES.get(args.size, 0) or args.rows, seed=args.seed), args.dir)
+    elif args.command == 'run':
+        result = run(args)
+        print_report(result)
+        if args.out:
+            with open(args.out, 'w') as f:
+                json.dump(result, f, indent=2)
+    else:
+        with open(args.base) as f:
+            base = json.load(f)
+        with open(args.new) as f:
+            new = json.load(f)
+        sys.exit(1 if compare(base, new, args.threshold) else 0)
@@ -0,0 +1,82 @@
+"""Streaming export and chunked import of table rows.
+
+Exports are generators: rows are taken from the resident table one chunk at
+a time and encoded as NDJSON or CSV as they go, so a response never holds
+more than one chunk of encoded text, however many rows the table has.
+Imports read the request body incrementally and hand the parsed records on
+in fixed-size batches, which the caller validates and commits one batch at
+a time.
+"""
+import csv
+import io
+import json
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Sequence, Tuple
+
+# format -> mimetype
+FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+DEFAULT_CHUNK = 1000
+
+
+def check_format(fmt: str) -> str:
+    if fmt not in FORMATS:
+        raise ValueError(f'Unknown format: {fmt} (choose from {", ".join(FORMATS)})')
+    return fmt
+
+
+def encode(chunks: Iterable[List[Dict]], fmt: str, fieldnames: Sequence[str]) -> Iterator[str]:
+    """``fieldnames`` of every row in ``chunks`` as NDJSON or CSV text,
+    one string per chunk (CSV starts with a header line)"""
+    if fmt == 'csv':
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames, extrasaction='ignore')
+        writer.writeheader()
+        for chunk in chunks:
+            writer.writerows(chunk)
+            if buffer.tell():
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()  # header of an empty export
+        return
+    for chunk in chunks:
+        if chunk:
+            yield ''.join(json.dumps({f: row.get(f, '') for f in fieldnames}) + '\n' for row in chunk)
+
+
+def decode(stream: BinaryIO, fmt: str) -> Iterator[Tuple[int, object]]:
+    """(line number, record) for each record in ``stream``, read as it
+    arrives. A line that isn't valid JSON yields a ValueError as its record
+    so one bad line doesn't abort the rest."""
+    text = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+    if fmt == 'csv':
+        reader = csv.DictReader(text)
+        for record in reader:
+            if None in record:
+                yield reader.line_num, ValueError('More values than columns')
+            else:
+                yield reader.line_num, record
+        return
+    for line_num, line in enumerate(text, 1):
+        if not line.strip():
+            continue
+        try:
+            yield line_num, json.loads(line)
+        except ValueError as e:
+            yield line_num, ValueError(f'Invalid JSON: {e}')
+
+
+def batches(items: Iterable, size: int = DEFAULT_CHUNK) -> Iterator[List]:
+    """Consecutive lists of up to ``size`` items"""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
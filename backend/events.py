@@ -0,0 +1,131 @@
+"""In-process change feed behind the server-sent events endpoints.
+
+A ChangeFeed is fed by an IndexedTable listener and keeps the most recent
+events in a bounded ring buffer. Each event id is "<epoch>-<seq>"; the epoch
+is unique per feed instance, so a client resuming with a Last-Event-ID from
+another worker or from before a restart is told to refetch instead of
+silently missing changes.
+"""
+import json
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+DEFAULT_CAPACITY = 1000
+
+
+class ChangeFeed:
+    """Bounded ring buffer of row changes that subscribers can wait on"""
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY):
+        self.epoch = uuid.uuid4().hex[:8]
+        self._events: deque = deque(maxlen=capacity)  # (seq, old_row, new_row or None)
+        self._seq = 0
+        self._cond = threading.Condition()
+        self.closed = False
+
+    def publish(self, old: Optional[Dict], new: Optional[Dict]):
+        """Record one changed row and wake up waiting subscribers"""
+        with self._cond:
+            self._seq += 1
+            self._events.append((self._seq, old, new))
+            self._cond.notify_all()
+
+    def reset(self, rows: List[Dict] = None):
+        """Forget history, e.g. after the table was reloaded from scratch"""
+        with self._cond:
+            self.epoch = uuid.uuid4().hex[:8]
+            self._events.clear()
+            self._seq = 0
+            self._cond.notify_all()
+
+    def close(self):
+        """End every stream reading this feed, e.g. when the server shuts down"""
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+    def position(self, last_event_id: Optional[str]) -> Tuple[Optional[str], int]:
+        """Resume point for a Last-Event-ID: (epoch, seq), epoch None if lost"""
+        with self._cond:
+            if not last_event_id:
+                return self.epoch, self._seq
+            epoch, _, seq = last_event_id.partition('-')
+            if epoch != self.epoch or not seq.isdigit() or int(seq) > self._seq:
+                return None, self._seq
+            seq = int(seq)
+            # Events after seq must still be in the buffer
+            oldest = self._events[0][0] if self._events else self._seq + 1
+            if seq + 1 < oldest:
+                return None, self._seq
+            return epoch, seq
+
+    def wait(self, epoch: str, seq: int, timeout: float) -> Tuple[List[Tuple[int, Optional[Dict], Optional[Dict]]], bool]:
+        """Events after ``seq`` (blocking up to ``timeout`` if there are none).
+
+        Returns (events, still_valid); still_valid is False once the feed was
+        reset or the subscriber fell further behind than the buffer holds.
+        """
+        with self._cond:
+            if epoch == self.epoch and seq == self._seq and not self.closed:
+                self._cond.wait(timeout)
+            if epoch != self.epoch:
+                return [], False
+            if self._events and self._events[0][0] > seq + 1:
+                return [], False
+            return [e for e in self._events if e[0] > seq], True
+
+
+def sse_message(data, event: Optional[str] = None, event_id: Optional[str] = None) -> str:
+    """Format one server-sent event"""
+    lines = []
+    if event_id:
+        lines.append(f'id: {event_id}')
+    if event:
+        lines.append(f'event: {event}')
+    lines.append(f'data: {json.dumps(data, separators=(",", ":"))}')
+    return '\n'.join(lines) + '\n\n'
+
+
+def stream(feed: ChangeFeed, matches: Callable[[Dict], bool], last_event_id: Optional[str],
+           refresh: Callable[[], None], poll_interval: float = 1.0,
+           heartbeat_interval: float = 15.0) -> Iterator[str]:
+    """Server-sent events for the rows ``matches`` accepts.
+
+    ``refresh`` runs between waits so changes committed by other worker
+    processes reach this feed too. A row that was deleted comes as a
+    ``remove`` event carrying its last state. A ``reset`` event tells the
+    client to refetch its list because events were lost. The stream ends
+    when the feed is closed; clients reconnect to another worker.
+    """
+    yield 'retry: 3000\n\n'
+    refresh()
+    epoch, seq = feed.position(last_event_id)
+    if epoch is None:
+        yield sse_message({}, event='reset')
+        epoch, seq = feed.position(None)
+    last_write = time.monotonic()
+    while not feed.closed:
+        events, valid = feed.wait(epoch, seq, poll_interval)
+        if not valid:
+            yield sse_message({}, event='reset')
+            epoch, seq = feed.position(None)
+            last_write = time.monotonic()
+            continue
+        for event_seq, old, new in events:
+            seq = event_seq
+            if new is None:
+                if matches(old):
+                    yield sse_message(dict(old), event='remove', event_id=f'{epoch}-{seq}')
+                    last_write = time.monotonic()
+            # A row that stopped matching (e.g. reassigned) is still news
+            elif matches(new) or (old is not None and matches(old)):
+                yield sse_message(dict(new), event='job', event_id=f'{epoch}-{seq}')
+                last_write = time.monotonic()
+        if not events:
+            refresh()
+        if time.monotonic() - last_write >= heartbeat_interval:
+            yield ': keepalive\n\n'
+            last_write = time.monotonic()
@@ -0,0 +1,47 @@
+"""Production server settings: ``gunicorn main:app`` from this directory.
+
+Every worker process imports the app, loads the resident tables and builds
+their indexes before it accepts a connection, then serves requests from a
+pool of threads behind admission control (see admission.py). On SIGTERM a
+worker stops accepting, sheds new requests, ends event streams and lets
+admitted requests and queued commits finish for up to graceful_timeout.
+"""
+import os
+import signal
+
+from admission import DEFAULT_THREADS
+
+bind = os.environ.get('APEX_BIND', '0.0.0.0:5001')
+workers = int(os.environ.get('APEX_WORKERS', min(4, os.cpu_count() or 1)))
+worker_class = 'gthread'
+threads = DEFAULT_THREADS
+# A worker that hasn't checked in for this long is restarted, so loading
+# the tables at startup must finish well within it
+timeout = int(os.environ.get('APEX_WORKER_TIMEOUT_S', 120))
+graceful_timeout = int(os.environ.get('APEX_DRAIN_TIMEOUT_S', 30))
+keepalive = 5
+
+# Behind gunicorn, admit requests per route class unless told otherwise
+os.environ.setdefault('APEX_ADMISSION', 'auto')
+
+
+def post_worker_init(worker):
+    """Warm the worker, and drain it as soon as it is told to stop"""
+    import main
+    main.warm_up()
+    worker.log.info('Worker %s loaded %d jobs', worker.pid, len(main.jobs_table))
+
+    stop = signal.getsignal(signal.SIGTERM)
+
+    def drain_then_stop(signum, frame):
+        main.drain()
+        stop(signum, frame)
+
+    signal.signal(signal.SIGTERM, drain_then_stop)
+
+
+def worker_exit(server, worker):
+    """Finish admitted requests and queued commits before the worker exits"""
+    import main
+    if not main.shutdown(graceful_timeout):
+        worker.log.warning('Worker %s exited with requests still in flight', worker.pid)
@@ -0,0 +1,347 @@
+"""CSV snapshot plus an append-only journal of row deltas.
+
+Rewriting a whole CSV for every one-field change makes each write O(table)
+and leaves a truncated file behind if the process dies half way. Instead,
+mutations append one JSON line per changed row to ``<table>.journal``::
+
+    {"jobID": "...", "contractorProgress_currentStep": "3"}
+
+Each line carries the row key plus the absolute new values of the fields
+that changed, so replaying a line twice is harmless. A deleted row leaves a
+tombstone, its key plus ``"_deleted": true``. The current state is
+the snapshot CSV with the journal replayed on top. Once the journal grows
+past ``compact_bytes`` a background thread folds it into a fresh snapshot.
+
+Appends, snapshot rewrites and compaction hold a locking.FileLock so worker
+processes sharing the files never interleave writes. Inside batch() appends
+are buffered and written with a single fsync when the batch ends (group
+commit). Readers take no file lock; they only consume complete lines and
+detect a swapped snapshot by its signature. Compaction leaves the journal
+entries it folded, and where they went, in ``<table>.journal.rebase``, so
+readers in every process carry their cursors over to the new files instead
+of reloading the table.
+"""
+import csv
+import json
+import os
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+from locking import FileLock
+from metrics import storage_op
+from store import DELETED, file_signature
+
+# Journal size that triggers a background compaction
+DEFAULT_COMPACT_BYTES = int(os.environ.get('APEX_JOURNAL_COMPACT_BYTES', 1 << 20))
+
+# (snapshot signature, journal offset) - how far a reader has consumed
+Cursor = Tuple[object, int]
+
+
+def read_csv_rows(path: str) -> List[Dict]:
+    """Read every row of a CSV file as dicts"""
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r', newline='') as f:
+        return list(csv.DictReader(f))
+
+
+def write_csv_rows(path: str, fieldnames: Sequence[str], rows: List[Dict]):
+    """Atomically replace a CSV file: write a temp file, fsync, rename"""
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(rows)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class JournaledCsv:
+    """One table stored as a CSV snapshot plus a journal of deltas"""
+
+    def __init__(self, path: str, journal_path: str, fieldnames: Sequence[str],
+                 key: Union[str, Sequence[str]], lock: Optional[FileLock] = None,
+                 compact_bytes: int = DEFAULT_COMPACT_BYTES, name: Optional[str] = None):
+        self.path = path
+        # Table name in metrics
+        self.name = name or os.path.splitext(os.path.basename(path))[0]
+        self.journal_path = journal_path
+        self.fieldnames = list(fieldnames)
+        self.key_fields = (key,) if isinstance(key, str) else tuple(key)
+        self.compact_bytes = compact_bytes
+        # lock: cross-process writer lock; _lock: this object's own state.
+        # Always take lock before _lock.
+        self.lock = lock or FileLock(f'{path}.lock')
+        self._lock = threading.RLock()
+        self._local = threading.local()
+        self._compacting = False
+        # Last compaction by any process: a JSON line [old snapshot sig,
+        # folded journal bytes, new snapshot sig, new journal inode], then
+        # the folded bytes themselves
+        self.rebase_path = f'{journal_path}.rebase'
+        self._recover()
+        if self._journal_size() > self.compact_bytes:
+            self.compact_in_background()
+
+    def row_key(self, row: Dict):
+        """Primary key of a row (a tuple for composite keys)"""
+        if len(self.key_fields) == 1:
+            return row[self.key_fields[0]]
+        return tuple(row[f] for f in self.key_fields)
+
+    # ---------- reading ----------
+
+    def load(self) -> Tuple[List[Dict], Cursor]:
+        """Snapshot rows with the whole journal replayed on top"""
+        with self._lock, storage_op(self.name, 'load') as op:
+            while True:
+                sig = file_signature(self.path)
+                rows = {self.row_key(r): r for r in read_csv_rows(self.path)}
+                deltas, offset = self._read_journal(0)
+                # Another process may have compacted while we were reading
+                if file_signature(self.path) == sig:
+                    break
+            for delta in deltas:
+                self.apply_delta(rows, delta)
+            op.rows = len(rows)
+            op.bytes_read = (sig[2] if sig else 0) + offset
+            return list(rows.values()), (sig, offset)
+
+    def changes(self, cursor: Cursor) -> Optional[Tuple[List[Dict], Cursor]]:
+        """Deltas appended since ``cursor``, or None if a full reload is needed"""
+        with self._lock:
+            (sig, offset), carried = self._rebased(cursor)
+            size = self._journal_size()
+            if file_signature(self.path) != sig or size < offset:
+                return None
+            if size == offset:
+                return carried, (sig, offset)  # nothing new, the common case
+            with storage_op(self.name, 'changes') as op:
+                deltas, end = self._read_journal(offset)
+                op.rows = len(deltas)
+                op.bytes_read = end - offset
+            if file_signature(self.path) != sig:
+                return None
+            return carried + deltas, (sig, end)
+
+    def apply_delta(self, rows: Dict[str, Dict], delta: Dict) -> Optional[Dict]:
+        """Fold one journal entry into ``rows`` and return the new row
+        (None for a tombstone)"""
+        key = self.row_key(delta)
+        if delta.get(DELETED):
+            rows.pop(key, None)
+            return None
+        old = rows.get(key)
+        if old is None:
+            row = dict.fromkeys(self.fieldnames, '')
+            row.update(delta)
+        else:
+            # Build a new dict: rows handed out earlier stay unchanged
+            row = {**old, **delta}
+        rows[key] = row
+        return row
+
+    def _journal_size(self) -> int:
+        try:
+            return os.path.getsize(self.journal_path)
+        except FileNotFoundError:
+            return 0
+
+    def _read_journal(self, offset: int) -> Tuple[List[Dict], int]:
+        """Parse complete journal lines from ``offset``; returns (deltas, end)"""
+        try:
+            with open(self.journal_path, 'rb') as f:
+                f.seek(offset)
+                data = f.read()
+        except FileNotFoundError:
+            return [], 0
+        # A line without its newline is still being written - leave it
+        complete = data[:data.rfind(b'\n') + 1]
+        deltas = [json.loads(line) for line in complete.splitlines() if line]
+        return deltas, offset + len(complete)
+
+    def _rebased(self, cursor: Cursor) -> Tuple[Cursor, List[Dict]]:
+        """Carry a cursor over the last compaction if it points into the
+        files that compaction replaced. Returns the new cursor and the
+        folded entries the reader hadn't consumed yet."""
+        sig, offset = cursor
+        current = file_signature(self.path)
+        if sig == current:
+            return cursor, []
+        try:
+            with open(self.rebase_path, 'rb') as f:
+                header = f.readline()
+                old_sig, folded, new_sig, journal_ino = json.loads(header)
+                old_sig, new_sig = (tuple(s) if s else None for s in (old_sig, new_sig))
+                # The journal check covers a compaction that has swapped the
+                # snapshot but not yet the journal
+                if (sig != old_sig or current != new_sig
+                        or os.stat(self.journal_path).st_ino != journal_ino):
+                    return cursor, []
+                if offset >= folded:
+                    return (current, offset - folded), []
+                f.seek(len(header) + offset)
+                missed = f.read(folded - offset)
+        except (OSError, ValueError):
+            return cursor, []
+        if len(missed) != folded - offset:
+            return cursor, []
+        return (current, 0), [json.loads(line) for line in missed.splitlines() if line]
+
+    def _recover(self):
+        """Drop a torn last line left behind by a crash mid-append"""
+        # With the writer lock held nobody can be half way through an append
+        with self.lock:
+            size = self._journal_size()
+            if not size:
+                return
+            with open(self.journal_path, 'rb+') as f:
+                data = f.read()
+                end = data.rfind(b'\n') + 1
+                if end != size:
+                    f.truncate(end)
+
+    # ---------- writing ----------
+
+    def append(self, deltas: List[Dict], cursor: Optional[Cursor]) -> Optional[Cursor]:
+        """Durably append deltas; returns the advanced reader cursor.
+
+        The cursor only moves past our own entries when nothing else was
+        appended since the caller last read, otherwise the next changes()
+        call replays them together with whatever came in between. Inside
+        batch() the deltas are only buffered and the cursor stays put.
+        """
+        buffer = getattr(self._local, 'buffer', None)
+        if buffer is not None:
+            buffer.extend(deltas)
+            return cursor
+        return self._write(deltas, cursor)
+
+    @contextmanager
+    def batch(self):
+        """Hold the writer lock and commit all appends with one fsync"""
+        with self.lock:
+            if getattr(self._local, 'buffer', None) is not None:
+                yield  # nested: the outer batch commits
+                return
+            self._local.buffer = []
+            try:
+                yield
+            finally:
+                # Rows are already applied in memory, so commit even if the
+                # batch body failed part way
+                pending, self._local.buffer = self._local.buffer, None
+                if pending:
+                    self._write(pending, None)
+
+    def _write(self, deltas: List[Dict], cursor: Optional[Cursor]) -> Optional[Cursor]:
+        payload = ''.join(json.dumps(d, separators=(',', ':')) + '\n' for d in deltas).encode('utf-8')
+        with self.lock, self._lock:
+            if cursor is not None:
+                rebased, carried = self._rebased(cursor)
+                if not carried:  # else changes() still has to hand them out
+                    cursor = rebased
+            with storage_op(self.name, 'upsert') as op, open(self.journal_path, 'ab') as f:
+                start = f.tell()
+                f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
+                end = f.tell()
+                op.rows = len(deltas)
+                op.bytes_written = len(payload)
+            sig = file_signature(self.path)
+            if cursor == (sig, start):
+                cursor = (sig, end)
+        if end > self.compact_bytes:
+            self.compact_in_background()
+        return cursor
+
+    def replace_all(self, rows: List[Dict]):
+        """Write a complete new snapshot and start an empty journal"""
+        with self.lock, self._lock:
+            buffer = getattr(self._local, 'buffer', None)
+            if buffer:
+                buffer.clear()  # superseded by the new snapshot
+            with storage_op(self.name, 'replace') as op:
+                write_csv_rows(self.path, self.fieldnames, rows)
+                open(self.journal_path, 'wb').close()
+                op.rows = len(rows)
+                op.bytes_written = os.path.getsize(self.path)
+            try:
+                os.remove(self.rebase_path)  # old cursors can't carry over
+            except FileNotFoundError:
+                pass
+
+    # ---------- compaction ----------
+
+    def compact_in_background(self):
+        """Fold the journal into the snapshot on a daemon thread"""
+        with self._lock:
+            if self._compacting:
+                return
+            self._compacting = True
+        threading.Thread(target=self._compact, name=f'compact-{self.path}', daemon=True).start()
+
+    def compact(self):
+        """Fold the journal into the snapshot on the calling thread"""
+        with self._lock:
+            if self._compacting:
+                return
+            self._compacting = True
+        self._compact()
+
+    def _compact(self):
+        try:
+            # Under the writer lock the journal ends on a complete line
+            with self.lock, self._lock:
+                sig = file_signature(self.path)
+                folded = self._journal_size()
+            if not folded:
+                return  # nothing to fold, maybe no journal yet
+            # The expensive part runs without the locks so appends continue
+            with storage_op(self.name, 'compact') as op:
+                rows = {self.row_key(r): r for r in read_csv_rows(self.path)}
+                with open(self.journal_path, 'rb') as f:
+                    head = f.read(folded)
+                for line in head.splitlines():
+                    if line:
+                        self.apply_delta(rows, json.loads(line))
+                # Per-process name: other workers may be compacting as well
+                tmp_path = f'{self.path}.{os.getpid()}.compact'
+                write_csv_rows(tmp_path, self.fieldnames, list(rows.values()))
+                op.rows = len(rows)
+                op.bytes_read = (sig[2] if sig else 0) + folded
+                op.bytes_written = os.path.getsize(tmp_path)
+
+            with self.lock, self._lock:
+                if file_signature(self.path) != sig:
+                    # Snapshot was replaced underneath us; try again later
+                    os.remove(tmp_path)
+                    return
+                # Carry over whatever was appended while we were writing
+                with open(self.journal_path, 'rb') as f:
+                    f.seek(folded)
+                    tail = f.read()
+                journal_tmp = f'{self.journal_path}.{os.getpid()}.compact'
+                with open(journal_tmp, 'wb') as f:
+                    f.write(tail)
+                    f.flush()
+                    os.fsync(f.fileno())
+                # Renames keep inode, mtime and size, so the record can be
+                # written before the swap it describes
+                rebase = [sig, folded, file_signature(tmp_path), os.stat(journal_tmp).st_ino]
+                rebase_tmp = f'{self.rebase_path}.{os.getpid()}.tmp'
+                with open(rebase_tmp, 'wb') as f:
+                    f.write(json.dumps(rebase).encode() + b'\n')
+                    f.write(head)
+                os.replace(rebase_tmp, self.rebase_path)
+                # Snapshot first: a crash in between only leaves entries
+                # that replay idempotently on top of the new snapshot
+                os.replace(tmp_path, self.path)
+                os.replace(journal_tmp, self.journal_path)
+        finally:
+            with self._lock:
+                self._compacting = False
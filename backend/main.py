@@ -1,91 +1,162 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Request, g, request, jsonify, send_file
 from flask_cors import CORS
-import csv
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+from werkzeug.exceptions import HTTPException, RequestEntityTooLarge
+import base64
+import gc
+import hashlib
+import json
 import os
+import threading
+import time
 import uuid
 from datetime import datetime
+from itertools import islice
 from typing import Dict, List, Optional
 
-app = Flask(__name__)
-CORS(app)  # Enable CORS for all routes
+import metrics
+from admission import AdmissionControl, limits_from_env
+from aggregates import JobStats
+from archive import DEFAULT_AFTER_DAYS, DEFAULT_INTERVAL, DEFAULT_STATUSES, SegmentArchive, last_activity
+from bulk import DEFAULT_CHUNK, FORMATS, batches, check_format, decode, encode
+from events import ChangeFeed, stream
+from profiling import RequestProfiler
+from records import RecordJSONProvider, record_type
+from search import JOB_SEARCH_FIELDS, InvertedIndex
+from storage import JOB_FIELDS, TABLES, open_backend
+from store import IndexedTable, SortedIndex, UniqueViolation
+from uploads import UnsupportedUpload, UploadStore, UploadTooLarge, is_upload_name
+from values import parse_number, parse_timestamp, typed_column
+from writer import CommitQueue
 
-# CSV file paths
-PROFILES_CSV = 'profiles.csv'
-JOBS_CSV = 'jobs.csv'
+class CappedRequest(Request):
+    """Request whose body is capped per endpoint (MAX_BODY_BYTES) while it
+    is read, so chunked uploads without a Content-Length are limited too"""
 
-# Ensure CSV files exist with headers
-def init_csv_files():
-    """Initialize CSV files with headers if they don't exist"""
-    
-    # Profiles CSV
-    if not os.path.exists(PROFILES_CSV):
-        with open(PROFILES_CSV, 'w', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerow(['profileID', 'email', 'password', 'user_role'])
-    
-    # Jobs CSV
-    if not os.path.exists(JOBS_CSV):
-        with open(JOBS_CSV, 'w', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerow([
-                'jobID', 'profileID', 'jobName', 'propertyAddress', 'city', 
-                'customerName', 'customerEmail', 'trade', 'estimatedPay', 
-                'description', 'scheduledTime', 'squareFootage', 'status',
-                'assignedContractorId', 'materialStatus', 'createdAt',
-                'contractorProgress_currentStep', 'contractorProgress_acknowledged', 
-                'contractorProgress_lastUpdated'
-            ])
+    @property
+    def max_content_length(self) -> Optional[int]:
+        limit = MAX_BODY_BYTES.get(self.endpoint)
+        return limit if limit is not None else super().max_content_length
+
+app = Flask(__name__)
+app.request_class = CappedRequest
+app.json = RecordJSONProvider(app)  # resident rows are records, not dicts
+CORS(app, expose_headers=['X-Next-Cursor', 'X-Total-Count', 'X-Search-Truncated', 'ETag'])  # Enable CORS for all routes
+
+# Storage backend: CSV files by default, SQLite with APEX_STORAGE=sqlite
+storage = open_backend()
 
 def read_profiles() -> List[Dict]:
-    """Read all profiles from CSV"""
-    profiles = []
-    if os.path.exists(PROFILES_CSV):
-        with open(PROFILES_CSV, 'r', newline='') as f:
-            reader = csv.DictReader(f)
-            profiles = list(reader)
-    return profiles
+    """Read all profiles"""
+    return [dict(p) for p in profiles_table.all()]
 
 def write_profiles(profiles: List[Dict]):
-    """Write profiles to CSV"""
+    """Write profiles"""
     if not profiles:
         return
-    with open(PROFILES_CSV, 'w', newline='') as f:
-        fieldnames = ['profileID', 'email', 'password', 'user_role']
-        writer = csv.DictWriter(f, fieldnames=fieldnames)
-        writer.writeheader()
-        writer.writerows(profiles)
-
-def read_jobs() -> List[Dict]:
-    """Read all jobs from CSV"""
-    jobs = []
-    if os.path.exists(JOBS_CSV):
-        with open(JOBS_CSV, 'r', newline='') as f:
-            reader = csv.DictReader(f)
-            jobs = list(reader)
-    return jobs
-
-def write_jobs(jobs: List[Dict]):
-    """Write jobs to CSV"""
-    if not jobs:
-        return
-    fieldnames = [
-        'jobID', 'profileID', 'jobName', 'propertyAddress', 'city', 
-        'customerName', 'customerEmail', 'trade', 'estimatedPay', 
-        'description', 'scheduledTime', 'squareFootage', 'status',
-        'assignedContractorId', 'materialStatus', 'createdAt',
-        'contractorProgress_currentStep', 'contractorProgress_acknowledged', 
-        'contractorProgress_lastUpdated'
-    ]
-    with open(JOBS_CSV, 'w', newline='') as f:
-        writer = csv.DictWriter(f, fieldnames=fieldnames)
-        writer.writeheader()
-        writer.writerows(jobs)
-
-# Initialize CSV files on startup
-init_csv_files()
+    profiles_table.replace_all(profiles)
+
+def table_record(table: str):
+    """Compact __slots__ record type for resident rows of ``table``"""
+    schema = TABLES[table]
+    return record_type(f'{table.title()}Record', schema.fieldnames, schema.interned, schema.types)
+
+# Profiles stay resident with a unique index on email, so login and signup
+# are hash lookups instead of scans over every user
+profiles_table = IndexedTable(
+    key='profileID',
+    indexes=TABLES['profiles'].indexes,
+    source=storage.table_source('profiles'),
+    unique=TABLES['profiles'].unique,
+    record=table_record('profiles'),
+)
+
+# Columns /api/jobs can sort and range-filter by, and how to read each one
+JOB_SORT_FIELDS = {
+    'createdAt': parse_timestamp,
+    'scheduledTime': parse_timestamp,
+    'estimatedPay': parse_number,
+    'squareFootage': parse_number,
+}
+
+# Jobs stay resident and indexed. With CSV storage, writes append single-row
+# deltas to jobs.journal, which is folded back into jobs.csv in the background.
+jobs_table = IndexedTable(
+    key='jobID',
+    indexes=TABLES['jobs'].indexes,
+    source=storage.table_source('jobs'),
+    orderings={field: typed_column(field, parse) for field, parse in JOB_SORT_FIELDS.items()},
+    record=table_record('jobs'),
+)
+
+# Compliance records stay resident too: one KYC submission per contractor,
+# one signed agreement per (contractorId, agreementId), grouped by contractor
+kyc_table = IndexedTable(
+    key=TABLES['kyc'].key,
+    indexes=TABLES['kyc'].indexes,
+    source=storage.table_source('kyc'),
+    record=table_record('kyc'),
+)
+agreements_table = IndexedTable(
+    key=TABLES['agreements'].key,
+    indexes=TABLES['agreements'].indexes,
+    source=storage.table_source('agreements'),
+    record=table_record('agreements'),
+)
+
+# All mutations run on one writer thread; whatever queues up while a batch
+# is being written goes into the next batch and shares its commit
+commits = CommitQueue(storage.batch, tables=(profiles_table, jobs_table, kyc_table, agreements_table))
+
+# Every committed job change, for /api/jobs/stream subscribers
+job_feed = ChangeFeed()
+jobs_table.add_listener(job_feed.publish, job_feed.reset)
+
+# Dashboard counters, updated on every job change instead of per request
+job_stats = JobStats()
+jobs_table.add_listener(job_stats.on_change, job_stats.on_reload)
+
+# Full-text index over the descriptive job columns, updated per job change
+job_search = InvertedIndex('jobID', JOB_SEARCH_FIELDS)
+jobs_table.add_listener(job_search.on_change, job_search.on_reload)
+
+# Finished jobs, moved out of jobs_table into compressed monthly segments
+job_archive = SegmentArchive(os.environ.get('APEX_ARCHIVE_DIR', 'archive'), 'jobs', JOB_FIELDS, 'jobID')
+
+# KYC photos, stored once per distinct content
+kyc_uploads = UploadStore(os.environ.get('APEX_UPLOAD_DIR', os.path.join('uploads', 'kyc')))
+
+# Largest request body per endpoint; others are unlimited (imports stream)
+MAX_BODY_BYTES = {
+    'submit_kyc': 2 * kyc_uploads.max_bytes + 64 * 1024,  # two photos plus form fields
+}
+
+# ==================== CONDITIONAL REQUESTS ====================
+
+def etag_for(*parts) -> str:
+    """Strong ETag built from version counters, never from the payload"""
+    return hashlib.sha1(repr(parts).encode()).hexdigest()[:32]
+
+def not_modified(etag: str):
+    """304 response if the client already holds ``etag``, else None"""
+    if etag in request.if_none_match:
+        response = app.response_class(status=304)
+        response.set_etag(etag)
+        return response
+    return None
+
+def tagged(response, etag: str):
+    """Attach the ETag and ask clients to revalidate before reusing it"""
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 # ==================== USER MANAGEMENT ====================
 
+def public_profile(profile: Dict) -> Dict:
+    """Copy of a profile without its password"""
+    return {k: v for k, v in profile.items() if k != 'password'}
+
 @app.route('/api/signup', methods=['POST'])
 def signup():
     """Create a new user profile"""
@@ -97,8 +168,7 @@ def signup():
             return jsonify({'error': 'Missing required fields: email, password, user_role'}), 400
         
         # Check if email already exists
-        profiles = read_profiles()
-        if any(p['email'] == data['email'] for p in profiles):
+        if profiles_table.lookup('email', data['email']):
             return jsonify({'error': 'Email already exists'}), 400
         
         # Create new profile
@@ -109,8 +179,11 @@ def signup():
             'user_role': data['user_role']
         }
         
-        profiles.append(new_profile)
-        write_profiles(profiles)
+        try:
+            commits.submit(profiles_table.put, new_profile)
+        except UniqueViolation:
+            # Lost a race with a concurrent signup for the same email
+            return jsonify({'error': 'Email already exists'}), 400
         
         return jsonify({
             'message': 'User created successfully',
@@ -124,13 +197,27 @@ def signup():
 
 @app.route('/api/profiles', methods=['GET'])
 def get_profiles():
-    """Get all profiles"""
+    """Get all profiles, or the single profile matching ?email="""
     try:
-        profiles = read_profiles()
+        email = request.args.get('email')
+        if email:
+            profile = profiles_table.lookup('email', email)
+            if not profile:
+                return jsonify({'error': 'Profile not found'}), 404
+            etag = etag_for('profile', profile['profileID'], profiles_table.record_version(profile['profileID']))
+            cached = not_modified(etag)
+            if cached:
+                return cached
+            return tagged(jsonify(public_profile(profile)), etag), 200
+        
+        etag = etag_for('profiles', profiles_table.version())
+        cached = not_modified(etag)
+        if cached:
+            return cached
+        
         # Don't return passwords in response
-        for profile in profiles:
-            profile.pop('password', None)
-        return jsonify(profiles), 200
+        profiles = [public_profile(p) for p in profiles_table.all()]
+        return tagged(jsonify(profiles), etag), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -138,103 +225,354 @@ def get_profiles():
 def get_profile(profile_id):
     """Get a specific profile by ID"""
     try:
-        profiles = read_profiles()
-        profile = next((p for p in profiles if p['profileID'] == profile_id), None)
+        profile = profiles_table.get(profile_id)
         
         if not profile:
             return jsonify({'error': 'Profile not found'}), 404
         
-        profile.pop('password', None)
-        return jsonify(profile), 200
+        return jsonify(public_profile(profile)), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# Signs the session tokens /api/login hands out. Without a key no tokens are
+# issued, so routes that need a profile (see requesting_profile) answer 401
+SECRET_KEY = os.environ.get('APEX_SECRET_KEY')
+DEFAULT_SESSION_TTL = int(os.environ.get('APEX_SESSION_TTL_S', 12 * 3600))
+sessions = URLSafeTimedSerializer(SECRET_KEY, salt='apex-session') if SECRET_KEY else None
+
 @app.route('/api/login', methods=['POST'])
 def login():
-    """Simple login - just verify credentials (no security for MVP)"""
+    """Verify credentials and issue a session token when APEX_SECRET_KEY is set"""
     try:
         data = request.json
         
         if not data.get('email') or not data.get('password'):
             return jsonify({'error': 'Missing email or password'}), 400
         
-        profiles = read_profiles()
-        profile = next((p for p in profiles if p['email'] == data['email'] and p['password'] == data['password']), None)
+        profile = profiles_table.lookup('email', data['email'])
         
-        if not profile:
+        if not profile or profile['password'] != data['password']:
             return jsonify({'error': 'Invalid credentials'}), 401
         
-        profile.pop('password', None)
-        return jsonify({
+        result = {
             'message': 'Login successful',
-            'profile': profile
-        }), 200
+            'profile': public_profile(profile)
+        }
+        if sessions is not None:
+            result['token'] = sessions.dumps(profile['profileID'])
+        
+        return jsonify(result), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 # ==================== JOB MANAGEMENT ====================
 
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+def encode_cursor(position) -> str:
+    """Opaque page cursor for a (sort value, jobID) position"""
+    return base64.urlsafe_b64encode(json.dumps(list(position)).encode()).decode().rstrip('=')
+
+def decode_cursor(cursor: str):
+    """Inverse of encode_cursor; raises ValueError for anything malformed"""
+    try:
+        value, job_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except Exception:
+        raise ValueError('Invalid cursor')
+    return value, job_id
+
+def parse_fields(fields_arg: Optional[str], allowed: List[str]) -> Optional[List[str]]:
+    """Columns requested with ?fields=a,b,c (None means all of them)"""
+    if not fields_arg:
+        return None
+    fields = [f.strip() for f in fields_arg.split(',') if f.strip()]
+    unknown = [f for f in fields if f not in allowed]
+    if unknown:
+        raise ValueError(f'Unknown fields: {", ".join(unknown)}')
+    return fields
+
 @app.route('/api/jobs', methods=['GET'])
 def get_jobs():
-    """Get all jobs, optionally filtered by profileID or status"""
+    """Get jobs, optionally filtered by profileID, status, assignedContractorId or trade
+
+    `sort` orders by createdAt, scheduledTime, estimatedPay or squareFootage
+    (prefix `-` for descending); `<column>_min` / `<column>_max` keep values
+    in a range. With `limit` (and the previous page's X-Next-Cursor as
+    `cursor`) jobs are paged, in createdAt order unless sorted otherwise;
+    `fields` limits the columns returned. `archived=include` adds archived
+    jobs, `archived=only` returns nothing else.
+    """
+    try:
+        filters = job_filters(request.args)
+        try:
+            fields = parse_fields(request.args.get('fields'), JOB_FIELDS)
+            order, reverse = parse_sort(request.args.get('sort'))
+            ranges = parse_ranges(request.args)
+            archived = request.args.get('archived', 'exclude')
+            if archived not in ARCHIVED_MODES:
+                raise ValueError(f'archived must be one of: {", ".join(ARCHIVED_MODES)}')
+            paged = 'limit' in request.args or 'cursor' in request.args
+            if paged:
+                limit = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
+                if not 1 <= limit <= MAX_PAGE_SIZE:
+                    raise ValueError(f'limit must be between 1 and {MAX_PAGE_SIZE}')
+                after = decode_cursor(request.args['cursor']) if request.args.get('cursor') else None
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        # Same table version and same query means the same response
+        archive_version = job_archive.version() if archived != 'exclude' else None
+        etag = etag_for('jobs', jobs_table.version(), archive_version, sorted(request.args.items(multi=True)))
+        cached = not_modified(etag)
+        if cached:
+            return cached
+        
+        # Equality filters go through the hash indexes; sorting and the range
+        # on the sort column walk that column's ordered index
+        next_position = None
+        if archived != 'exclude':
+            jobs, next_position = jobs_with_archive(
+                archived, filters, order, reverse, ranges,
+                after if paged else None, limit if paged else None, paged)
+        elif paged or order or ranges:
+            order = order or next(iter(ranges), 'createdAt')
+            lo, hi = ranges.pop(order, (None, None))
+            where = ranges_filter(ranges)
+            jobs, next_position = jobs_table.page(
+                order, after if paged else None, limit if paged else None,
+                reverse=reverse, lo=lo, hi=hi, where=where, **filters)
+        else:
+            jobs = jobs_table.find(**filters)
+        
+        if fields:
+            jobs = [{f: j.get(f, '') for f in fields} for j in jobs]
+        
+        response = tagged(jsonify(jobs), etag)
+        if next_position:
+            response.headers['X-Next-Cursor'] = encode_cursor(next_position)
+        return response, 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+ARCHIVED_MODES = ('exclude', 'include', 'only')
+
+def jobs_with_archive(mode: str, filters: Dict, order: Optional[str], reverse: bool,
+                      ranges: Dict[str, tuple], after, limit: Optional[int], paged: bool):
+    """A /api/jobs query answered from the archive as well (``mode``
+    'include') or from the archive alone ('only'): every archived job is
+    scanned, so this is only done when asked for. Returns (jobs, position
+    of the next page or None)."""
+    wanted = {f: v for f, v in filters.items() if v}
+    where = ranges_filter(ranges)
+    active = jobs_table.keys()
+    jobs = [] if mode == 'only' else [j for j in jobs_table.find(**filters) if where is None or where(j)]
+    for job in job_archive.rows():
+        # A job still active (say, its archiving was interrupted) is
+        # served from the active table only
+        if (job['jobID'] not in active and all(job.get(f) == v for f, v in wanted.items())
+                and (where is None or where(job))):
+            jobs.append(job)
+    if not (paged or order or ranges):
+        return jobs, None
+    order = order or next(iter(ranges), 'createdAt')
+    lo, hi = ranges.get(order, (None, None))
+    by_id = {j['jobID']: j for j in jobs}
+    entries = SortedIndex.build(jobs_table.orderings[order].value, by_id.items()).scan(after, lo, hi, reverse)
+    if limit is None:
+        return [by_id[k] for _, k in entries], None
+    page = list(islice(entries, limit + 1))
+    next_position = page[limit - 1] if len(page) > limit else None
+    return [by_id[k] for _, k in page[:limit]], next_position
+
+def job_filters(args) -> Dict[str, Optional[str]]:
+    """Equality filters of a /api/jobs query"""
+    return {
+        'profileID': args.get('profileID'),
+        'status': args.get('status'),
+        'assignedContractorId': args.get('assignedContractorId'),
+        'trade': args.get('trade'),
+    }
+
+def parse_sort(sort_arg: Optional[str]):
+    """'-estimatedPay' -> ('estimatedPay', True); no sort -> (None, False)"""
+    if not sort_arg:
+        return None, False
+    order = sort_arg.lstrip('-')
+    if order not in JOB_SORT_FIELDS:
+        raise ValueError(f'Cannot sort by: {order}')
+    return order, sort_arg.startswith('-')
+
+def parse_ranges(args) -> Dict[str, tuple]:
+    """{column: (lo, hi)} from `<column>_min` / `<column>_max` arguments"""
+    ranges = {}
+    for field, parse in JOB_SORT_FIELDS.items():
+        bounds = []
+        for suffix in ('_min', '_max'):
+            raw = args.get(field + suffix)
+            value = parse(raw) if raw else None
+            if raw and value is None:
+                raise ValueError(f'Invalid value for {field}{suffix}: {raw}')
+            bounds.append(value)
+        if bounds != [None, None]:
+            ranges[field] = tuple(bounds)
+    return ranges
+
+def in_range(value, bounds) -> bool:
+    lo, hi = bounds
+    return value is not None and (lo is None or value >= lo) and (hi is None or value <= hi)
+
+def ranges_filter(ranges: Dict[str, tuple]):
+    """Predicate keeping jobs inside every range, None if there are none"""
+    if not ranges:
+        return None
+    def where(job):
+        return all(in_range(JOB_SORT_FIELDS[f](job.get(f)), r) for f, r in ranges.items())
+    return where
+
+@app.route('/api/jobs/stats', methods=['GET'])
+def get_job_stats():
+    """Job counts by status, trade, city and contractor, and pay totals by status"""
     try:
-        jobs = read_jobs()
-        profile_id = request.args.get('profileID')
-        status = request.args.get('status')
-        assigned_contractor = request.args.get('assignedContractorId')
-        
-        # Filter jobs
-        if profile_id:
-            jobs = [j for j in jobs if j.get('profileID') == profile_id]
-        if status:
-            jobs = [j for j in jobs if j.get('status') == status]
-        if assigned_contractor:
-            jobs = [j for j in jobs if j.get('assignedContractorId') == assigned_contractor]
-        
-        return jsonify(jobs), 200
+        contractor_id = request.args.get('contractorId')
+        
+        etag = etag_for('jobs', jobs_table.version(), 'stats', contractor_id)
+        cached = not_modified(etag)
+        if cached:
+            return cached
+        
+        return tagged(jsonify(job_stats.snapshot(contractor_id)), etag), 200
+        
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/jobs/search', methods=['GET'])
+def search_jobs():
+    """Full-text search over job name, description, address, city and customer
+    
+    Every word in `q` must match a whole word or the start of one; the best
+    `limit` jobs come first. `status` and `trade` narrow the results and
+    X-Total-Count tells how many jobs matched overall. X-Search-Truncated
+    says a short prefix only matched its most common words.
+    """
+    try:
+        query = request.args.get('q', '').strip()
+        if not query:
+            return jsonify({'error': 'Missing q'}), 400
+        try:
+            fields = parse_fields(request.args.get('fields'), JOB_FIELDS)
+            limit = int(request.args.get('limit', 20))
+            if not 1 <= limit <= MAX_PAGE_SIZE:
+                raise ValueError(f'limit must be between 1 and {MAX_PAGE_SIZE}')
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        etag = etag_for('jobs', jobs_table.version(), 'search', sorted(request.args.items(multi=True)))
+        cached = not_modified(etag)
+        if cached:
+            return cached
+        
+        filters = {
+            'status': request.args.get('status'),
+            'trade': request.args.get('trade'),
+        }
+        allowed = jobs_table.keys(**filters) if any(filters.values()) else None
+        ranked, total, truncated = job_search.search(query, limit, allowed.__contains__ if allowed is not None else None)
+        
+        jobs = []
+        for job_id, score in ranked:
+            job = jobs_table.get(job_id)
+            if job is None:
+                continue  # deleted since the index was read
+            job = {f: job.get(f, '') for f in fields} if fields else dict(job)
+            job['score'] = round(score, 3)
+            jobs.append(job)
+        
+        response = tagged(jsonify(jobs), etag)
+        response.headers['X-Total-Count'] = str(total)
+        if truncated:
+            response.headers['X-Search-Truncated'] = 'true'
+        return response, 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/jobs/stream', methods=['GET'])
+def stream_jobs():
+    """Server-sent events carrying each job as it changes
+
+    Filter with profileID and/or assignedContractorId. Reconnecting clients
+    send Last-Event-ID to resume; a `reset` event means history was lost and
+    the job list should be refetched.
+    """
+    profile_id = request.args.get('profileID')
+    contractor_id = request.args.get('assignedContractorId')
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('lastEventId')
+    
+    def matches(job):
+        return ((not profile_id or job.get('profileID') == profile_id) and
+                (not contractor_id or job.get('assignedContractorId') == contractor_id))
+    
+    response = app.response_class(
+        stream(job_feed, matches, last_event_id, jobs_table.refresh),
+        mimetype='text/event-stream',
+    )
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # don't let proxies buffer events
+    return response
+
+JOB_REQUIRED_FIELDS = ['profileID', 'jobName', 'propertyAddress', 'city',
+                       'customerName', 'customerEmail', 'trade', 'estimatedPay', 'description']
+
+# Items accepted by one /api/jobs/batch or /api/jobs/assign/batch request
+MAX_JOB_BATCH = 10000
+
+def initial_status(data) -> str:
+    """Status a new job starts out in"""
+    return 'InProgress' if data.get('assignedContractorId') else 'Open'
+
+def build_job(data) -> Dict:
+    """New job record from a create request; ValueError if it is invalid"""
+    if not isinstance(data, dict):
+        raise ValueError('Job must be an object')
+    
+    # Validate required fields
+    missing = [field for field in JOB_REQUIRED_FIELDS if not data.get(field)]
+    if missing:
+        raise ValueError(f'Missing required fields: {", ".join(missing)}')
+    
+    return {
+        'jobID': str(uuid.uuid4()),
+        'profileID': data['profileID'],
+        'jobName': data['jobName'],
+        'propertyAddress': data['propertyAddress'],
+        'city': data['city'],
+        'customerName': data['customerName'],
+        'customerEmail': data['customerEmail'],
+        'trade': data['trade'],
+        'estimatedPay': data['estimatedPay'],
+        'description': data['description'],
+        'scheduledTime': data.get('scheduledTime', ''),
+        'squareFootage': data.get('squareFootage', ''),
+        'status': initial_status(data),
+        'assignedContractorId': data.get('assignedContractorId', ''),
+        'materialStatus': data.get('materialStatus', ''),
+        'createdAt': datetime.now().isoformat(),
+        'contractorProgress_currentStep': '1' if data.get('assignedContractorId') else '',
+        'contractorProgress_acknowledged': 'False' if data.get('assignedContractorId') else '',
+        'contractorProgress_lastUpdated': datetime.now().isoformat() if data.get('assignedContractorId') else ''
+    }
+
 @app.route('/api/jobs', methods=['POST'])
 def create_job():
     """Create a new job"""
     try:
-        data = request.json
-        
-        # Validate required fields
-        required_fields = ['profileID', 'jobName', 'propertyAddress', 'city', 
-                          'customerName', 'customerEmail', 'trade', 'estimatedPay', 'description']
-        missing = [field for field in required_fields if not data.get(field)]
-        if missing:
-            return jsonify({'error': f'Missing required fields: {", ".join(missing)}'}), 400
-        
-        # Create new job
-        new_job = {
-            'jobID': str(uuid.uuid4()),
-            'profileID': data['profileID'],
-            'jobName': data['jobName'],
-            'propertyAddress': data['propertyAddress'],
-            'city': data['city'],
-            'customerName': data['customerName'],
-            'customerEmail': data['customerEmail'],
-            'trade': data['trade'],
-            'estimatedPay': data['estimatedPay'],
-            'description': data['description'],
-            'scheduledTime': data.get('scheduledTime', ''),
-            'squareFootage': data.get('squareFootage', ''),
-            'status': 'InProgress' if data.get('assignedContractorId') else 'Open',
-            'assignedContractorId': data.get('assignedContractorId', ''),
-            'materialStatus': data.get('materialStatus', ''),
-            'createdAt': datetime.now().isoformat(),
-            'contractorProgress_currentStep': '1' if data.get('assignedContractorId') else '',
-            'contractorProgress_acknowledged': 'False' if data.get('assignedContractorId') else '',
-            'contractorProgress_lastUpdated': datetime.now().isoformat() if data.get('assignedContractorId') else ''
-        }
+        try:
+            new_job = build_job(request.json)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
-        jobs = read_jobs()
-        jobs.append(new_job)
-        write_jobs(jobs)
+        commits.submit(jobs_table.put, new_job)
         
         return jsonify({
             'message': 'Job created successfully',
@@ -246,48 +584,80 @@ def create_job():
 
 @app.route('/api/jobs/<job_id>', methods=['GET'])
 def get_job(job_id):
-    """Get a specific job by ID"""
+    """Get a specific job by ID, from the archive if it is no longer active"""
     try:
-        jobs = read_jobs()
-        job = next((j for j in jobs if j['jobID'] == job_id), None)
+        version = jobs_table.record_version(job_id)
+        if version is None:
+            return get_archived_job(job_id)
         
+        etag = etag_for('job', job_id, version)
+        cached = not_modified(etag)
+        if cached:
+            return cached
+        
+        job = jobs_table.get(job_id)
         if not job:
             return jsonify({'error': 'Job not found'}), 404
         
-        return jsonify(job), 200
+        return tagged(jsonify(job), etag), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def get_archived_job(job_id):
+    """Response for a job missing from the active table"""
+    etag = etag_for('archived-job', job_id, job_archive.version())
+    cached = not_modified(etag)
+    if cached:
+        return cached
+    job = job_archive.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return tagged(jsonify(job), etag), 200
+
+def missing_job(job_id):
+    """Error response for a job that can't be changed because it isn't active"""
+    if job_id in job_archive:
+        return jsonify({'error': 'Job is archived and can no longer be changed'}), 409
+    return jsonify({'error': 'Job not found'}), 404
+
 @app.route('/api/jobs/<job_id>', methods=['PUT'])
 def update_job(job_id):
     """Update a job"""
     try:
         data = request.json
-        jobs = read_jobs()
         
-        job_index = next((i for i, j in enumerate(jobs) if j['jobID'] == job_id), None)
-        if job_index is None:
-            return jsonify({'error': 'Job not found'}), 404
+        # Read-modify-write on the writer thread so concurrent updates can't
+        # overwrite each other
+        def apply():
+            existing = jobs_table.get(job_id)
+            if existing is None:
+                return None
+            job = dict(existing)
+            
+            # Update job fields (skip jobID as it shouldn't be changed)
+            for key, value in data.items():
+                if key == 'jobID':
+                    continue  # Skip jobID, it's immutable
+                elif key == 'contractorProgress':
+                    # Handle nested contractorProgress object
+                    if isinstance(value, dict):
+                        job[f'contractorProgress_currentStep'] = str(value.get('currentStep', ''))
+                        job[f'contractorProgress_acknowledged'] = str(value.get('acknowledged', ''))
+                        job[f'contractorProgress_lastUpdated'] = value.get('lastUpdated', '')
+                elif key in job:
+                    # Only update fields that exist in the job record
+                    job[key] = value
+            
+            jobs_table.put(job)
+            return job
         
-        # Update job fields (skip jobID as it shouldn't be changed)
-        for key, value in data.items():
-            if key == 'jobID':
-                continue  # Skip jobID, it's immutable
-            elif key == 'contractorProgress':
-                # Handle nested contractorProgress object
-                if isinstance(value, dict):
-                    jobs[job_index][f'contractorProgress_currentStep'] = str(value.get('currentStep', ''))
-                    jobs[job_index][f'contractorProgress_acknowledged'] = str(value.get('acknowledged', ''))
-                    jobs[job_index][f'contractorProgress_lastUpdated'] = value.get('lastUpdated', '')
-            elif key in jobs[job_index]:
-                # Only update fields that exist in the job record
-                jobs[job_index][key] = value
-        
-        write_jobs(jobs)
+        job = commits.submit(apply)
+        if job is None:
+            return missing_job(job_id)
         
         return jsonify({
             'message': 'Job updated successfully',
-            'job': jobs[job_index]
+            'job': job
         }), 200
         
     except Exception as e:
@@ -303,54 +673,134 @@ def assign_job(job_id):
         if not contractor_id:
             return jsonify({'error': 'Missing contractorId'}), 400
         
-        jobs = read_jobs()
-        job_index = next((i for i, j in enumerate(jobs) if j['jobID'] == job_id), None)
+        def apply():
+            existing = jobs_table.get(job_id)
+            if existing is None:
+                return None
+            job = assigned(existing, contractor_id)
+            jobs_table.put(job)
+            return job
         
-        if job_index is None:
-            return jsonify({'error': 'Job not found'}), 404
+        job = commits.submit(apply)
+        if job is None:
+            return missing_job(job_id)
+        
+        return jsonify({
+            'message': 'Job assigned successfully',
+            'job': job
+        }), 200
         
-        jobs[job_index]['assignedContractorId'] = str(contractor_id)
-        jobs[job_index]['status'] = 'InProgress'
-        jobs[job_index]['contractorProgress_currentStep'] = '1'
-        jobs[job_index]['contractorProgress_acknowledged'] = 'False'
-        jobs[job_index]['contractorProgress_lastUpdated'] = datetime.now().isoformat()
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def assigned(existing: Dict, contractor_id) -> Dict:
+    """Copy of a job assigned to ``contractor_id`` with progress reset"""
+    job = dict(existing)
+    job['assignedContractorId'] = str(contractor_id)
+    job['status'] = 'InProgress'
+    job['contractorProgress_currentStep'] = '1'
+    job['contractorProgress_acknowledged'] = 'False'
+    job['contractorProgress_lastUpdated'] = datetime.now().isoformat()
+    return job
+
+def batch_items(data, name: str) -> List:
+    """The ``name`` list of a batch request body; ValueError if unusable"""
+    items = data.get(name) if isinstance(data, dict) else None
+    if not isinstance(items, list) or not items:
+        raise ValueError(f'{name} must be a non-empty list')
+    if len(items) > MAX_JOB_BATCH:
+        raise ValueError(f'At most {MAX_JOB_BATCH} {name} per request')
+    return items
+
+@app.route('/api/jobs/batch', methods=['POST'])
+def create_jobs_batch():
+    """Create many jobs in one commit
+    
+    Every item is validated like POST /api/jobs. Valid items are created
+    together, invalid ones are reported; `results` holds one entry per item,
+    in request order, with the status code the single-job route would give.
+    """
+    try:
+        try:
+            items = batch_items(request.json, 'jobs')
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
-        write_jobs(jobs)
+        results = []
+        new_jobs = []
+        for data in items:
+            try:
+                job = build_job(data)
+            except ValueError as e:
+                results.append({'status': 400, 'error': str(e)})
+                continue
+            new_jobs.append(job)
+            results.append({'status': 201, 'job': job})
+        
+        if new_jobs:
+            commits.submit(jobs_table.put, *new_jobs)
         
         return jsonify({
-            'message': 'Job assigned successfully',
-            'job': jobs[job_index]
+            'created': len(new_jobs),
+            'failed': len(items) - len(new_jobs),
+            'results': results
         }), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-# ==================== KYC VERIFICATION ====================
+@app.route('/api/jobs/assign/batch', methods=['POST'])
+def assign_jobs_batch():
+    """Assign many jobs in one commit
+    
+    Takes `assignments`, a list of {jobId, contractorId}. Items are checked
+    like POST /api/jobs/<job_id>/assign and applied in order, so a job listed
+    twice ends up with the later contractor.
+    """
+    try:
+        try:
+            items = batch_items(request.json, 'assignments')
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        def apply():
+            results = []
+            jobs = {}
+            for item in items:
+                job_id = item.get('jobId') if isinstance(item, dict) else None
+                contractor_id = item.get('contractorId') if isinstance(item, dict) else None
+                if not job_id or not contractor_id:
+                    results.append({'status': 400, 'error': 'Missing jobId or contractorId'})
+                    continue
+                if not isinstance(job_id, str):
+                    results.append({'status': 400, 'error': 'jobId must be a string'})
+                    continue
+                existing = jobs.get(job_id) or jobs_table.get(job_id)
+                if existing is None:
+                    if job_id in job_archive:
+                        results.append({'status': 409, 'jobId': job_id, 'error': 'Job is archived'})
+                    else:
+                        results.append({'status': 404, 'jobId': job_id, 'error': 'Job not found'})
+                    continue
+                job = jobs[job_id] = assigned(existing, contractor_id)
+                results.append({'status': 200, 'job': job})
+            if jobs:
+                jobs_table.put(*jobs.values())
+            return results
+        
+        results = commits.submit(apply)
+        assigned_count = sum(1 for r in results if r['status'] == 200)
+        
+        return jsonify({
+            'assigned': assigned_count,
+            'failed': len(results) - assigned_count,
+            'results': results
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
-KYC_CSV = 'kyc_submissions.csv'
-
-def init_kyc_csv():
-    """Initialize KYC CSV file"""
-    if not os.path.exists(KYC_CSV):
-        with open(KYC_CSV, 'w', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerow(['contractorId', 'idPhotoUrl', 'selfieUrl', 'status', 'submittedAt', 'verifiedAt'])
-
-def read_kyc():
-    """Read all KYC submissions"""
-    submissions = []
-    if os.path.exists(KYC_CSV):
-        with open(KYC_CSV, 'r', newline='') as f:
-            reader = csv.DictReader(f)
-            submissions = list(reader)
-    return submissions
-
-def write_kyc(submissions):
-    """Write KYC submissions to CSV"""
-    with open(KYC_CSV, 'w', newline='') as f:
-        writer = csv.DictWriter(f, fieldnames=['contractorId', 'idPhotoUrl', 'selfieUrl', 'status', 'submittedAt', 'verifiedAt'])
-        writer.writeheader()
-        writer.writerows(submissions)
+# ==================== KYC VERIFICATION ====================
 
 @app.route('/api/kyc/submit', methods=['POST'])
 def submit_kyc():
@@ -358,44 +808,43 @@ def submit_kyc():
     try:
         # For MVP, we'll store base64 images or file paths
         # In production, you'd upload to S3/cloud storage
-        data = request.form
+        try:
+            # Parsing stops at MAX_BODY_BYTES, declared length or not
+            data = request.form
+            id_photo = request.files.get('idPhoto')
+            selfie_photo = request.files.get('selfiePhoto')
+        except RequestEntityTooLarge:
+            return jsonify({'error': 'Upload too large'}), 413
         contractor_id = data.get('contractorId', '')
         
-        # Get uploaded files
-        id_photo = request.files.get('idPhoto')
-        selfie_photo = request.files.get('selfiePhoto')
-        
         if not id_photo or not selfie_photo:
             return jsonify({'error': 'Missing required photos'}), 400
         
-        # Save files (simplified - in production use cloud storage)
-        id_photo_path = f'uploads/kyc/{contractor_id}_id_{datetime.now().timestamp()}.jpg'
-        selfie_photo_path = f'uploads/kyc/{contractor_id}_selfie_{datetime.now().timestamp()}.jpg'
+        # Copied in chunks under their content hash; identical resubmissions
+        # reuse the stored file
+        try:
+            id_photo_name = kyc_uploads.save(id_photo.stream)
+            selfie_photo_name = kyc_uploads.save(selfie_photo.stream)
+        except UploadTooLarge as e:
+            return jsonify({'error': str(e)}), 413
+        except UnsupportedUpload as e:
+            return jsonify({'error': str(e)}), 400
         
-        os.makedirs('uploads/kyc', exist_ok=True)
-        id_photo.save(id_photo_path)
-        selfie_photo.save(selfie_photo_path)
+        # EXIF stripping and thumbnails happen off the request thread
+        kyc_uploads.process_in_background(id_photo_name)
+        kyc_uploads.process_in_background(selfie_photo_name)
         
-        # Update or create KYC record
-        submissions = read_kyc()
-        existing = next((s for s in submissions if s['contractorId'] == contractor_id), None)
-        
-        if existing:
-            existing['idPhotoUrl'] = id_photo_path
-            existing['selfieUrl'] = selfie_photo_path
-            existing['status'] = 'pending'
-            existing['submittedAt'] = datetime.now().isoformat()
-        else:
-            submissions.append({
-                'contractorId': contractor_id,
-                'idPhotoUrl': id_photo_path,
-                'selfieUrl': selfie_photo_path,
-                'status': 'pending',
-                'submittedAt': datetime.now().isoformat(),
-                'verifiedAt': ''
-            })
+        id_photo_path = kyc_uploads.path(id_photo_name)
+        selfie_photo_path = kyc_uploads.path(selfie_photo_name)
         
-        write_kyc(submissions)
+        # Update or create KYC record (verifiedAt survives a resubmission)
+        commits.submit(kyc_table.put, {
+            'contractorId': contractor_id,
+            'idPhotoUrl': id_photo_path,
+            'selfieUrl': selfie_photo_path,
+            'status': 'pending',
+            'submittedAt': datetime.now().isoformat()
+        })
         
         return jsonify({
             'message': 'KYC submission received',
@@ -413,48 +862,96 @@ def get_kyc_status():
         if not contractor_id:
             return jsonify({'error': 'Missing contractorId'}), 400
         
-        submissions = read_kyc()
-        submission = next((s for s in submissions if s['contractorId'] == contractor_id), None)
+        etag = etag_for('kyc', contractor_id, kyc_table.record_version(contractor_id))
+        cached = not_modified(etag)
+        if cached:
+            return cached
         
-        if not submission:
-            return jsonify({'status': 'not_started'}), 200
+        return tagged(jsonify(kyc_summary(kyc_table.get(contractor_id))), etag), 200
         
-        return jsonify({
-            'status': submission['status'],
-            'submittedAt': submission.get('submittedAt', ''),
-            'verifiedAt': submission.get('verifiedAt', '')
-        }), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def kyc_summary(submission: Optional[Dict]) -> Dict:
+    """KYC status as /api/kyc/status reports it"""
+    if not submission:
+        return {'status': 'not_started'}
+    return {
+        'status': submission['status'],
+        'submittedAt': submission.get('submittedAt', ''),
+        'verifiedAt': submission.get('verifiedAt', ''),
+        'idPhotoUrl': kyc_photo_url(submission.get('idPhotoUrl', '')),
+        'selfieUrl': kyc_photo_url(submission.get('selfieUrl', ''))
+    }
+
+def kyc_photo_url(path: str) -> Optional[str]:
+    """API URL serving a stored KYC photo, None for pre-hash uploads"""
+    name = os.path.basename(path)
+    return f'/api/kyc/photos/{name}' if is_upload_name(name) else None
+
+def requesting_profile() -> Optional[Dict]:
+    """Profile of the session token in the Authorization header
+
+    Tokens come from /api/login, signed with APEX_SECRET_KEY, and expire
+    after APEX_SESSION_TTL_S. The role is read from the profile on every
+    request, so a demoted admin loses access at once. Never read the token
+    from the query string, where it would end up in logs and Referer headers.
+    """
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    if sessions is None or scheme.lower() != 'bearer' or not token:
+        return None
+    try:
+        profile_id = sessions.loads(token.strip(), max_age=DEFAULT_SESSION_TTL)
+    except BadSignature:  # forged, or expired
+        return None
+    return profiles_table.get(profile_id) if isinstance(profile_id, str) else None
+
+@app.route('/api/kyc/photos/<name>', methods=['GET'])
+def get_kyc_photo(name):
+    """Serve a KYC photo (?variant=thumb for the review thumbnail)
+    
+    Only admins and the contractor who submitted the photo may fetch it.
+    Names are content hashes, so responses are cached as immutable; Range
+    and conditional requests are handled by send_file, which hands the file
+    to the server's zero-copy file wrapper instead of reading it into memory.
+    """
+    try:
+        if not is_upload_name(name):
+            return jsonify({'error': 'Photo not found'}), 404
+        variant = request.args.get('variant', 'full')
+        if variant not in ('full', 'thumb'):
+            return jsonify({'error': f'Unknown variant: {variant}'}), 400
+        
+        profile = requesting_profile()
+        if profile is None:
+            return jsonify({'error': 'Authentication required'}), 401
+        if profile.get('user_role') != 'admin':
+            submission = kyc_table.get(profile['profileID'])
+            if submission is None or kyc_uploads.path(name) not in (submission.get('idPhotoUrl'), submission.get('selfieUrl')):
+                return jsonify({'error': 'Forbidden'}), 403
+        
+        path = kyc_uploads.path(name)
+        if not os.path.exists(path):
+            return jsonify({'error': 'Photo not found'}), 404
+        
+        # Serve only the processed file: it must not change once cached.
+        # Photos Pillow can't read are served unprocessed.
+        kyc_uploads.ensure_processed(name)
+        
+        # Without Pillow there are no thumbnails; fall back to the photo
+        if variant == 'thumb' and os.path.exists(kyc_uploads.thumbnail_path(name)):
+            path = kyc_uploads.thumbnail_path(name)
+        
+        response = send_file(os.path.abspath(path), conditional=True, etag=f'{name}-{variant}', max_age=31536000)
+        # Authenticated content: browsers may keep it, shared caches may not
+        response.headers['Cache-Control'] = 'private, max-age=31536000, immutable'
+        return response
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 # ==================== AGREEMENTS ====================
 
-AGREEMENTS_CSV = 'agreements_signed.csv'
-
-def init_agreements_csv():
-    """Initialize agreements CSV file"""
-    if not os.path.exists(AGREEMENTS_CSV):
-        with open(AGREEMENTS_CSV, 'w', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerow(['contractorId', 'agreementId', 'version', 'signedName', 'signedAt'])
-
-def read_agreements():
-    """Read all signed agreements"""
-    signed = []
-    if os.path.exists(AGREEMENTS_CSV):
-        with open(AGREEMENTS_CSV, 'r', newline='') as f:
-            reader = csv.DictReader(f)
-            signed = list(reader)
-    return signed
-
-def write_agreements(signed):
-    """Write signed agreements to CSV"""
-    with open(AGREEMENTS_CSV, 'w', newline='') as f:
-        writer = csv.DictWriter(f, fieldnames=['contractorId', 'agreementId', 'version', 'signedName', 'signedAt'])
-        writer.writeheader()
-        writer.writerows(signed)
-
 @app.route('/api/agreements/status', methods=['GET'])
 def get_agreements_status():
     """Get agreement signing status for a contractor"""
@@ -463,10 +960,14 @@ def get_agreements_status():
         if not contractor_id:
             return jsonify({'error': 'Missing contractorId'}), 400
         
-        signed = read_agreements()
-        contractor_agreements = [a for a in signed if a['contractorId'] == contractor_id]
+        etag = etag_for('agreements', agreements_table.version(), contractor_id)
+        cached = not_modified(etag)
+        if cached:
+            return cached
         
-        return jsonify(contractor_agreements), 200
+        contractor_agreements = agreements_table.find(contractorId=contractor_id)
+        
+        return tagged(jsonify(contractor_agreements), etag), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -484,25 +985,14 @@ def sign_agreement():
         if not all([contractor_id, agreement_id, version, signed_name]):
             return jsonify({'error': 'Missing required fields'}), 400
         
-        signed = read_agreements()
-        
-        # Check if already signed
-        existing = next((a for a in signed if a['contractorId'] == contractor_id and a['agreementId'] == agreement_id), None)
-        
-        if existing:
-            existing['version'] = version
-            existing['signedName'] = signed_name
-            existing['signedAt'] = datetime.now().isoformat()
-        else:
-            signed.append({
-                'contractorId': contractor_id,
-                'agreementId': agreement_id,
-                'version': version,
-                'signedName': signed_name,
-                'signedAt': datetime.now().isoformat()
-            })
-        
-        write_agreements(signed)
+        # Insert, or re-sign if (contractorId, agreementId) already exists
+        commits.submit(agreements_table.put, {
+            'contractorId': contractor_id,
+            'agreementId': agreement_id,
+            'version': version,
+            'signedName': signed_name,
+            'signedAt': datetime.now().isoformat()
+        })
         
         return jsonify({
             'message': 'Agreement signed successfully',
@@ -513,6 +1003,301 @@ def sign_agreement():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# ==================== COMPLIANCE ====================
+
+MAX_COMPLIANCE_BATCH = 1000
+
+@app.route('/api/compliance/status', methods=['POST'])
+def get_compliance_status():
+    """KYC state and signed agreement versions for many contractors at once"""
+    try:
+        data = request.json or {}
+        contractor_ids = data.get('contractorIds')
+        if not isinstance(contractor_ids, list) or not all(isinstance(c, str) and c for c in contractor_ids):
+            return jsonify({'error': 'contractorIds must be a list of contractor IDs'}), 400
+        contractor_ids = list(dict.fromkeys(contractor_ids))
+        if len(contractor_ids) > MAX_COMPLIANCE_BATCH:
+            return jsonify({'error': f'At most {MAX_COMPLIANCE_BATCH} contractorIds per request'}), 400
+        
+        # One index lookup per contractor in each table, no scans
+        submissions = kyc_table.get_many(contractor_ids)
+        signed = agreements_table.group('contractorId', contractor_ids)
+        
+        return jsonify({
+            contractor_id: {
+                'kyc': kyc_summary(submissions.get(contractor_id)),
+                'agreements': {
+                    a['agreementId']: {'version': a['version'], 'signedAt': a['signedAt']}
+                    for a in signed[contractor_id]
+                }
+            }
+            for contractor_id in contractor_ids
+        }), 200
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# ==================== EXPORT AND IMPORT ====================
+
+# Collection -> resident table
+COLLECTIONS = {
+    'jobs': jobs_table,
+    'profiles': profiles_table,
+    'kyc': kyc_table,
+    'agreements': agreements_table,
+}
+
+# Columns an imported row must fill in besides its key
+IMPORT_REQUIRED_FIELDS = {
+    'jobs': JOB_REQUIRED_FIELDS,
+    'profiles': ['email', 'user_role'],
+    'kyc': ['status'],
+    'agreements': ['version'],
+}
+
+# Never exported, and refused on import: an import must not set passwords
+HIDDEN_FIELDS = {'profiles': ['password']}
+
+IMPORT_BATCH = 1000
+MAX_IMPORT_ERRORS = 100
+
+def admin_error():
+    """401/403 response unless the request comes from an admin, else None"""
+    profile = requesting_profile()
+    if profile is None:
+        return jsonify({'error': 'Authentication required'}), 401
+    if profile.get('user_role') != 'admin':
+        return jsonify({'error': 'Forbidden'}), 403
+    return None
+
+def job_chunks(filters: Dict, order: Optional[str], reverse: bool, ranges: Dict[str, tuple]):
+    """Jobs matching a /api/jobs query, one keyset page of DEFAULT_CHUNK at a time"""
+    order = order or next(iter(ranges), 'createdAt')
+    lo, hi = ranges.pop(order, (None, None))
+    where = ranges_filter(ranges)
+    after = None
+    while True:
+        jobs, after = jobs_table.page(order, after, DEFAULT_CHUNK, reverse=reverse,
+                                      lo=lo, hi=hi, where=where, **filters)
+        yield jobs
+        if after is None:
+            return
+
+@app.route('/api/export/<collection>', methods=['GET'])
+def export_collection(collection):
+    """Stream a collection as NDJSON (default) or CSV (?format=csv)
+
+    Admins only. Jobs take the filters, `sort`, ranges and `fields` of
+    GET /api/jobs. Rows are read and encoded a chunk at a time while the
+    response is sent, so memory use doesn't grow with the export.
+    """
+    try:
+        denied = admin_error()
+        if denied:
+            return denied
+        if collection not in COLLECTIONS:
+            return jsonify({'error': f'Unknown collection: {collection}'}), 404
+        
+        hidden = HIDDEN_FIELDS.get(collection, [])
+        allowed = [f for f in TABLES[collection].fieldnames if f not in hidden]
+        try:
+            fmt = check_format(request.args.get('format', 'ndjson'))
+            fields = parse_fields(request.args.get('fields'), allowed) or allowed
+            if collection == 'jobs':
+                order, reverse = parse_sort(request.args.get('sort'))
+                chunks = job_chunks(job_filters(request.args), order, reverse, parse_ranges(request.args))
+            else:
+                chunks = COLLECTIONS[collection].chunks(DEFAULT_CHUNK)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        response = app.response_class(encode(chunks, fmt, fields), mimetype=FORMATS[fmt])
+        response.headers['Content-Disposition'] = f'attachment; filename={collection}.{fmt}'
+        return response, 200
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def import_row(collection: str, record) -> Dict:
+    """Row to store for one imported record; ValueError if it is invalid"""
+    if isinstance(record, ValueError):
+        raise record  # the line couldn't be parsed
+    if not isinstance(record, dict):
+        raise ValueError('Row must be an object')
+    schema = TABLES[collection]
+    unknown = [f for f in record if f not in schema.fieldnames]
+    if unknown:
+        raise ValueError(f'Unknown fields: {", ".join(map(str, unknown))}')
+    hidden = [f for f in HIDDEN_FIELDS.get(collection, []) if f in record]
+    if hidden:
+        raise ValueError(f'Fields cannot be imported: {", ".join(hidden)}')
+    missing = [f for f in list(schema.key) + IMPORT_REQUIRED_FIELDS[collection] if not record.get(f)]
+    if missing:
+        raise ValueError(f'Missing required fields: {", ".join(missing)}')
+    nested = [f for f, v in record.items() if isinstance(v, (dict, list))]
+    if nested:
+        raise ValueError(f'Fields must be strings or numbers: {", ".join(nested)}')
+    if collection == 'jobs' and not record.get('status'):
+        # New jobs start out like created ones; existing ones keep theirs
+        record = dict(record)
+        if jobs_table.get(record['jobID']) is None:
+            record['status'] = initial_status(record)
+        else:
+            record.pop('status', None)
+    return record
+
+def put_rows(table: IndexedTable, rows: List[tuple]) -> List[tuple]:
+    """put() (line, row) pairs together, or one by one if some collide in a
+    unique column; returns the (line, error) pairs that were refused"""
+    try:
+        table.put(*(row for _, row in rows))
+        return []
+    except UniqueViolation:
+        pass
+    refused = []
+    for line, row in rows:
+        try:
+            table.put(row)
+        except UniqueViolation as e:
+            refused.append((line, str(e)))
+    return refused
+
+@app.route('/api/import/<collection>', methods=['POST'])
+def import_collection(collection):
+    """Insert or update rows from an NDJSON (default) or CSV request body
+
+    Admins only. The body is parsed as it is read and committed IMPORT_BATCH
+    rows at a time; a batch that was committed stays committed if the
+    import stops later. Invalid rows are skipped and reported by line.
+    """
+    try:
+        denied = admin_error()
+        if denied:
+            return denied
+        if collection not in COLLECTIONS:
+            return jsonify({'error': f'Unknown collection: {collection}'}), 404
+        try:
+            fmt = check_format(request.args.get('format', 'ndjson'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        table = COLLECTIONS[collection]
+        imported = 0
+        rejected = []
+        rejected_count = 0
+        for batch in batches(decode(request.stream, fmt), IMPORT_BATCH):
+            rows = []
+            refused = []
+            for line, record in batch:
+                try:
+                    rows.append((line, import_row(collection, record)))
+                except ValueError as e:
+                    refused.append((line, str(e)))
+            if rows:
+                refused.extend(commits.submit(put_rows, table, rows))
+            imported += len(batch) - len(refused)
+            rejected_count += len(refused)
+            rejected.extend(refused[:MAX_IMPORT_ERRORS - len(rejected)])
+        
+        return jsonify({
+            'imported': imported,
+            'rejected': rejected_count,
+            'errors': [{'line': line, 'error': error} for line, error in sorted(rejected)]
+        }), 200
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# ==================== ARCHIVE ====================
+
+# Jobs moved per commit, so other writes get in between archiving batches
+ARCHIVE_BATCH = 5000
+
+def archive_jobs(after_days: float = DEFAULT_AFTER_DAYS, limit: int = ARCHIVE_BATCH) -> int:
+    """Move up to ``limit`` jobs that sat in a final status for ``after_days``
+    into the archive; returns how many moved. Runs on the writer thread."""
+    cutoff = time.time() - after_days * 86400
+    def idle(job):
+        at = last_activity(job)
+        return at is not None and at < cutoff
+    due = (job for status in DEFAULT_STATUSES for job in jobs_table.find(status=status) if idle(job))
+    jobs = list(islice(due, limit))
+    if not jobs:
+        return 0
+    # Archive first: a crash in between leaves a job in both tiers, and
+    # the active copy wins until the next pass moves it again
+    job_archive.add(jobs)
+    return len(jobs_table.delete(*jobs))
+
+def archive_due_jobs(after_days: float = DEFAULT_AFTER_DAYS) -> int:
+    """Archive every job that is due, one commit per batch"""
+    total = 0
+    while True:
+        moved = commits.submit(archive_jobs, after_days)
+        total += moved
+        if moved < ARCHIVE_BATCH:
+            return total
+
+@app.route('/api/archive/jobs', methods=['POST'])
+def archive_jobs_now():
+    """Archive finished jobs now instead of waiting for the next background pass
+
+    Admin only. `olderThanDays` in the body overrides APEX_ARCHIVE_AFTER_DAYS.
+    """
+    try:
+        denied = admin_error()
+        if denied:
+            return denied
+        
+        data = request.get_json(silent=True) or {}
+        try:
+            after_days = float(data.get('olderThanDays', DEFAULT_AFTER_DAYS))
+        except (TypeError, ValueError):
+            return jsonify({'error': 'olderThanDays must be a number'}), 400
+        if after_days < 0:
+            return jsonify({'error': 'olderThanDays must not be negative'}), 400
+        
+        archived = archive_due_jobs(after_days)
+        return jsonify({'archived': archived, 'active': len(jobs_table)}), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# Set on shutdown to stop the background archiving passes
+archiver_stop = threading.Event()
+
+def archive_periodically(interval: float):
+    """Background loop archiving due jobs every ``interval`` seconds"""
+    while not archiver_stop.wait(interval):
+        try:
+            archive_due_jobs()
+        except Exception:
+            app.logger.exception('Archiving jobs failed')
+
+if DEFAULT_INTERVAL > 0:
+    threading.Thread(target=archive_periodically, args=(DEFAULT_INTERVAL,),
+                     name='job-archiver', daemon=True).start()
+
+# ==================== METRICS ====================
+
+@app.before_request
+def start_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        # The rule, not the path: /api/jobs/<job_id> is one series, not one per job
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.REQUEST_SECONDS.observe(time.perf_counter() - started, method=request.method, route=route)
+        metrics.REQUESTS.inc(method=request.method, route=route, status=response.status_code)
+    return response
+
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """Request, storage and commit metrics in Prometheus text format"""
+    return app.response_class(metrics.REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
 # ==================== HEALTH CHECK ====================
 
 @app.route('/api/health', methods=['GET'])
@@ -520,9 +1305,81 @@ def health():
     """Health check endpoint"""
     return jsonify({'status': 'healthy', 'message': 'API is running'}), 200
 
-# Initialize KYC and Agreements CSV files (after all function definitions)
-init_kyc_csv()
-init_agreements_csv()
+# ==================== PROFILING ====================
+
+def is_admin_request() -> bool:
+    """Whether the requesting profile (see requesting_profile) is an admin"""
+    profile = requesting_profile()
+    return profile is not None and profile.get('user_role') == 'admin'
+
+# Off unless a signed-in admin sends X-Profile-Request: 1 or APEX_PROFILE_SAMPLE_RATE > 0
+profiler = RequestProfiler.from_env(authorized=is_admin_request)
+for endpoint, view in list(app.view_functions.items()):
+    if endpoint != 'static':
+        app.view_functions[endpoint] = profiler.wrap(view)
+app.after_request(profiler.annotate)
+
+# ==================== SERVER ====================
+
+# Admission class of routes that aren't plain reads (GET) or writes; None
+# is never shed
+ROUTE_CLASSES = {
+    'health': None,
+    'get_metrics': None,
+    'login': 'read',
+    'get_compliance_status': 'read',
+    'stream_jobs': 'stream',
+    'create_jobs_batch': 'bulk',
+    'assign_jobs_batch': 'bulk',
+    'export_collection': 'bulk',
+    'import_collection': 'bulk',
+    'archive_jobs_now': 'bulk',
+}
+
+def route_class(environ) -> Optional[str]:
+    """Admission class of a request, by the endpoint it routes to"""
+    try:
+        endpoint, _ = app.url_map.bind_to_environ(environ).match()
+    except HTTPException:
+        endpoint = None  # 404s, 405s and redirects are cheap reads
+    if endpoint in ROUTE_CLASSES:
+        return ROUTE_CLASSES[endpoint]
+    return 'read' if environ.get('REQUEST_METHOD') in ('GET', 'HEAD', 'OPTIONS') else 'write'
+
+# Off unless APEX_ADMISSION is set; gunicorn.conf.py turns it on
+admission_limits = limits_from_env()
+admission = AdmissionControl(admission_limits or {}, route_class)
+if admission_limits:
+    app.wsgi_app = admission.wrap(app.wsgi_app)
+
+def warm_up():
+    """Load every resident table and build its indexes before serving traffic"""
+    for table in (profiles_table, jobs_table, kyc_table, agreements_table):
+        table.refresh()
+    # Resident records, unlike dicts of strings, stay tracked by the cycle
+    # collector, and every full collection would walk all of them. They
+    # never form cycles, so park what startup built outside its generations,
+    # once per process; refcounting still frees the ones later replaced.
+    gc.collect()
+    gc.freeze()
+
+def drain():
+    """Stop taking on work: shed new requests, end event streams and stop
+    archiving. Returns at once, so it is safe to call from a signal handler."""
+    admission.drain()
+    job_feed.close()
+    archiver_stop.set()
+
+def shutdown(timeout: float = 30.0) -> bool:
+    """Drain, wait up to ``timeout`` seconds for admitted requests, then
+    commit queued mutations and finish photo processing. Returns whether
+    the in-flight requests finished in time."""
+    drain()
+    finished = admission.wait_idle(timeout)
+    commits.close(timeout)
+    kyc_uploads.close()
+    storage.close()
+    return finished
 
 if __name__ == '__main__':
     # Seed demo data on first run
@@ -558,5 +1415,7 @@ if __name__ == '__main__':
         write_profiles(demo_profiles)
         print("Demo profiles created!")
     
-    app.run(debug=True, host='0.0.0.0', port=5001)
+    warm_up()
+    # Development server only; production runs under gunicorn (see gunicorn.conf.py)
+    app.run(debug=os.environ.get('APEX_DEBUG') == '1', host='0.0.0.0', port=5001)
 
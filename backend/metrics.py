@@ -0,0 +1,198 @@
+"""Process-local counters and histograms in Prometheus text format.
+
+main.py times every request by route and counts responses by status code;
+journal.py and storage.py time each storage operation per table and count
+the rows and bytes it moved; writer.py times commit batches; admission.py
+counts the requests it sheds. Everything is served by GET /api/metrics.
+With several worker processes each one reports its own numbers - scrape
+them individually or sum them in the query.
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+
+def _format_labels(names: Sequence[str], values: Tuple, extra: str = '') -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+    """Monotonically increasing value per label set"""
+
+    kind = 'counter'
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels[n] for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(tuple(labels[n] for n in self.labelnames), 0)
+
+    def lines(self) -> Iterator[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}'
+
+
+class Histogram:
+    """Observations counted into cumulative buckets per label set"""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [count per bucket (+Inf last), sum]
+        self._series: Dict[Tuple, List] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels[n] for n in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            # Index len(buckets) is the +Inf bucket
+            series[0][bisect.bisect_left(self.buckets, value)] += 1
+            series[1] += value
+
+    def lines(self) -> Iterator[str]:
+        with self._lock:
+            series = sorted((k, (list(v[0]), v[1])) for k, v in self._series.items())
+        for key, (counts, total) in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else _format_value(bound)
+                labels = _format_labels(self.labelnames, key, 'le="' + le + '"')
+                yield f'{self.name}_bucket{labels} {cumulative}'
+            yield f'{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}'
+            yield f'{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}'
+
+
+class Registry:
+    """The metrics one process exposes"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        metric = Counter(name, help, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, help, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format"""
+        out = []
+        for metric in self._metrics:
+            out.append(f'# HELP {metric.name} {metric.help}')
+            out.append(f'# TYPE {metric.name} {metric.kind}')
+            out.extend(metric.lines())
+        return '\n'.join(out) + '\n'
+
+
+REGISTRY = Registry()
+
+# ==================== HTTP ====================
+
+REQUEST_SECONDS = REGISTRY.histogram(
+    'apex_http_request_duration_seconds', 'Time to produce a response, by route',
+    ('method', 'route'))
+REQUESTS = REGISTRY.counter(
+    'apex_http_requests_total', 'Responses sent, by route and status code',
+    ('method', 'route', 'status'))
+
+# ==================== ADMISSION ====================
+
+ADMISSION_REJECTED = REGISTRY.counter(
+    'apex_admission_rejected_total', 'Requests shed by admission control, by route class and reason',
+    ('route_class', 'reason'))
+ADMISSION_WAIT_SECONDS = REGISTRY.histogram(
+    'apex_admission_wait_seconds', 'Time queued requests waited for a slot, by route class',
+    ('route_class',))
+
+# ==================== STORAGE ====================
+
+STORAGE_SECONDS = REGISTRY.histogram(
+    'apex_storage_operation_duration_seconds', 'Time spent in storage operations',
+    ('table', 'op'))
+STORAGE_ROWS = REGISTRY.counter(
+    'apex_storage_rows_total', 'Rows read or written by storage operations',
+    ('table', 'op'))
+STORAGE_BYTES = REGISTRY.counter(
+    'apex_storage_bytes_total', 'Bytes read or written by storage operations',
+    ('table', 'op', 'direction'))
+
+COMMIT_SECONDS = REGISTRY.histogram(
+    'apex_commit_duration_seconds', 'Time to run and commit one batch of mutations')
+COMMIT_WAIT_SECONDS = REGISTRY.histogram(
+    'apex_commit_queue_wait_seconds', 'Time a mutation waited for the writer thread')
+COMMIT_BATCH_SIZE = REGISTRY.histogram(
+    'apex_commit_batch_size', 'Mutations committed together', buckets=SIZE_BUCKETS)
+
+
+class StorageOp:
+    """What one storage operation moved; filled in by the caller"""
+
+    __slots__ = ('rows', 'bytes_read', 'bytes_written')
+
+    def __init__(self):
+        self.rows = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+
+@contextmanager
+def storage_op(table: str, op: str) -> Iterator[StorageOp]:
+    """Time a storage operation and record the rows and bytes it reports"""
+    record = StorageOp()
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        STORAGE_SECONDS.observe(time.perf_counter() - start, table=table, op=op)
+        if record.rows:
+            STORAGE_ROWS.inc(record.rows, table=table, op=op)
+        if record.bytes_read:
+            STORAGE_BYTES.inc(record.bytes_read, table=table, op=op, direction='read')
+        if record.bytes_written:
+            STORAGE_BYTES.inc(record.bytes_written, table=table, op=op, direction='write')
+
+
+def row_bytes(rows: List[Dict]) -> int:
+    """Approximate size of rows: the length of their values"""
+    return sum(len(str(v)) for row in rows for v in row.values())
@@ -0,0 +1,166 @@
+"""Opt-in profiling of single requests.
+
+RequestProfiler.wrap() goes around every Flask view. A request is profiled
+when an admin asks for it with the ``X-Profile-Request: 1`` header, or when
+it is picked by the APEX_PROFILE_SAMPLE_RATE lottery. Otherwise the wrapper
+costs one header lookup (plus one random() call when sampling is on).
+
+Profiles are written to APEX_PROFILE_DIR, newest APEX_PROFILE_KEEP files
+kept. With APEX_PROFILE_SLOW_MS set, only requests at least that slow are
+kept. APEX_PROFILE_FORMAT picks the file format:
+
+- ``folded`` (default): one "frame;frame;frame microseconds" line per call
+  stack, the input of flamegraph.pl, speedscope and similar viewers
+- ``pstats``: cProfile output for pstats, snakeviz or gprof2dot
+
+Only the request thread is traced; mutations run on the commit writer
+thread show up as time spent waiting in CommitQueue.submit.
+"""
+import cProfile
+import functools
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Callable, Dict, Optional, Tuple
+
+from flask import g, request
+
+PROFILE_HEADER = 'X-Profile-Request'
+
+logger = logging.getLogger(__name__)
+
+
+class FoldedProfiler:
+    """Exact call-stack profiler producing folded stacks for flame graphs"""
+
+    def __init__(self):
+        self.stacks: Dict[Tuple[str, ...], float] = defaultdict(float)
+        self._stack = []
+        self._last = 0.0
+
+    def enable(self):
+        self._last = time.perf_counter()
+        sys.setprofile(self._event)
+
+    def disable(self):
+        sys.setprofile(None)
+
+    def _event(self, frame, event, arg):
+        now = time.perf_counter()
+        if self._stack:
+            self.stacks[tuple(self._stack)] += now - self._last
+        if event == 'call':
+            code = frame.f_code
+            self._stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+        elif event == 'c_call':
+            self._stack.append(getattr(arg, '__qualname__', None) or getattr(arg, '__name__', repr(arg)))
+        elif self._stack:
+            # return, c_return, c_exception; frames entered before enable()
+            # return without a matching call, so ignore those
+            self._stack.pop()
+        self._last = time.perf_counter()
+
+    def dump(self, path: str):
+        with open(path, 'w') as f:
+            for stack, seconds in sorted(self.stacks.items()):
+                micros = int(seconds * 1_000_000)
+                if micros:
+                    f.write(f'{";".join(stack)} {micros}\n')
+
+
+class RequestProfiler:
+    """Decides which requests to profile and keeps the resulting files"""
+
+    def __init__(self, directory: str, sample_rate: float = 0.0, slow_ms: float = 0.0,
+                 keep: int = 100, fmt: str = 'folded',
+                 authorized: Callable[[], bool] = lambda: False):
+        if fmt not in ('folded', 'pstats'):
+            raise ValueError(f'Unknown profile format: {fmt}')
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.keep = keep
+        self.fmt = fmt
+        self.authorized = authorized
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, authorized: Callable[[], bool]) -> 'RequestProfiler':
+        return cls(
+            directory=os.environ.get('APEX_PROFILE_DIR', 'profiles'),
+            sample_rate=float(os.environ.get('APEX_PROFILE_SAMPLE_RATE', 0)),
+            slow_ms=float(os.environ.get('APEX_PROFILE_SLOW_MS', 0)),
+            keep=int(os.environ.get('APEX_PROFILE_KEEP', 100)),
+            fmt=os.environ.get('APEX_PROFILE_FORMAT', 'folded'),
+            authorized=authorized,
+        )
+
+    def wanted(self) -> bool:
+        """Whether the current request should be profiled"""
+        if request.headers.get(PROFILE_HEADER) == '1':
+            return self.authorized()
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def wrap(self, view: Callable) -> Callable:
+        """``view`` profiled whenever wanted() says so"""
+
+        @functools.wraps(view)
+        def profiled(*args, **kwargs):
+            if not self.wanted():
+                return view(*args, **kwargs)
+            profiler = cProfile.Profile() if self.fmt == 'pstats' else FoldedProfiler()
+            started = time.perf_counter()
+            try:
+                profiler.enable()
+            except ValueError:
+                return view(*args, **kwargs)  # another profiler is active
+            try:
+                return view(*args, **kwargs)
+            finally:
+                profiler.disable()
+                elapsed_ms = (time.perf_counter() - started) * 1000
+                if elapsed_ms >= self.slow_ms:
+                    self._save(profiler, elapsed_ms)
+
+        return profiled
+
+    def annotate(self, response):
+        """after_request hook naming the saved profile in X-Profile-File"""
+        name = g.pop('profile_file', None)
+        if name is not None:
+            response.headers['X-Profile-File'] = name
+        return response
+
+    def _save(self, profiler, elapsed_ms: float) -> Optional[str]:
+        endpoint = (request.endpoint or 'unknown').replace('.', '_')
+        stamp = datetime.now().strftime('%Y%m%dT%H%M%S%f')
+        ext = 'prof' if self.fmt == 'pstats' else 'folded'
+        name = f'{stamp}-{request.method}-{endpoint}-{int(elapsed_ms)}ms.{ext}'
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, name)
+            if self.fmt == 'pstats':
+                profiler.dump_stats(path)
+            else:
+                profiler.dump(path)
+            self._rotate()
+            g.profile_file = name
+            return path
+        except OSError as e:
+            logger.warning('Could not write profile %s: %s', name, e)
+            return None
+
+    def _rotate(self):
+        """Delete the oldest profiles beyond ``keep``"""
+        with self._lock:
+            names = sorted(n for n in os.listdir(self.directory) if n.endswith(('.prof', '.folded')))
+            for old in names[:max(len(names) - self.keep, 0)]:
+                try:
+                    os.remove(os.path.join(self.directory, old))
+                except FileNotFoundError:
+                    pass
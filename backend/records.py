@@ -0,0 +1,153 @@
+"""Compact resident rows.
+
+csv.DictReader hands back every row as a dict of strings that repeats all
+the column names: a 19-column job costs over a kilobyte before counting
+any of its values. The record types built by record_type() keep the
+values in __slots__ instead. Columns that only ever hold a handful of
+values (status, trade, role) are interned, so every Open job shares one
+'Open' string. Typed columns keep a compact value: integers as ints and
+the 'True'/'False' flags as bools. A value is only stored typed when it
+converts back to exactly the text it came from; anything else (say
+"$12,450") stays a string.
+
+Records are read-only Mappings. Code written against row dicts keeps
+working unchanged: get(), [], items(), dict(row) and {**row, ...} all
+behave the same. RecordJSONProvider turns records back into plain
+objects when a response is serialized.
+"""
+import keyword
+import sys
+from collections.abc import Mapping
+from operator import attrgetter
+from typing import Callable, Dict, Iterable, Optional, Tuple, Type
+
+from flask.json.provider import DefaultJSONProvider
+
+
+def _int_value(text: str):
+    try:
+        number = int(text)
+    except ValueError:
+        return text
+    return number if str(number) == text else text
+
+
+def _bool_value(text: str):
+    return True if text == 'True' else False if text == 'False' else text
+
+
+# kind -> (text -> compact value or the text itself, compact value -> text)
+TYPES: Dict[str, Tuple[Callable, Callable]] = {
+    'int': (_int_value, str),
+    'bool': (_bool_value, lambda flag: 'True' if flag else 'False'),
+}
+
+
+class Record(Mapping):
+    """Base of the generated record types; one slot per column"""
+
+    __slots__ = ()
+    fields: Tuple[str, ...] = ()
+    _field_set: frozenset = frozenset()
+    _interned: frozenset = frozenset()
+    # field -> (encode, decode) of its kind in TYPES
+    _types: Dict[str, Tuple[Callable, Callable]] = {}
+    _values = staticmethod(lambda record: ())
+
+    def __init__(self, values: Mapping = None):
+        values = values or {}
+        interned = self._interned
+        types = self._types
+        for field in self.fields:
+            value = values.get(field, '')
+            if value is None:
+                value = ''
+            elif type(value) is str and value:
+                if field in interned:
+                    value = sys.intern(value)
+                elif field in types:
+                    value = types[field][0](value)
+            setattr(self, field, value)
+
+    def __getitem__(self, field: str):
+        if field in self._field_set:
+            value = getattr(self, field)
+            return value if type(value) is str else self._text(field, value)
+        raise KeyError(field)
+
+    def get(self, field: str, default=None):
+        if field in self._field_set:
+            value = getattr(self, field)
+            return value if type(value) is str else self._text(field, value)
+        return default
+
+    def _text(self, field: str, value):
+        """Stored value of a typed column back as its original text"""
+        codec = self._types.get(field)
+        return value if codec is None else codec[1](value)
+
+    def __contains__(self, field) -> bool:
+        return field in self._field_set
+
+    def __iter__(self):
+        return iter(self.fields)
+
+    def __len__(self) -> int:
+        return len(self.fields)
+
+    def __eq__(self, other) -> bool:
+        if type(other) is type(self):
+            return self._values(self) == other._values(other)
+        return super().__eq__(other)
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}({self.to_dict()!r})'
+
+    def to_dict(self) -> Dict[str, str]:
+        """The row as the plain dict the API has always returned"""
+        row = dict(zip(self.fields, self._values(self)))
+        for field, (_, text) in self._types.items():
+            value = row[field]
+            if type(value) is not str:
+                row[field] = text(value)
+        return row
+
+
+def record_type(name: str, fields: Iterable[str], interned: Iterable[str] = (),
+                types: Optional[Dict[str, str]] = None) -> Type[Record]:
+    """Record class with one slot per column in ``fields``. Values of the
+    ``interned`` columns are interned as records are built; ``types`` maps
+    columns to a kind in TYPES to store them compactly."""
+    fields = tuple(fields)
+    interned = tuple(interned)
+    types = dict(types or {})
+    clashing = [f for f in fields if not f.isidentifier() or keyword.iskeyword(f) or hasattr(Record, f)]
+    if clashing:
+        raise ValueError(f'Column names unusable as record slots: {", ".join(clashing)}')
+    unknown = [f for f in interned + tuple(types) if f not in fields]
+    if unknown:
+        raise ValueError(f'Columns not in fields: {", ".join(unknown)}')
+    kinds = [k for k in types.values() if k not in TYPES]
+    if kinds:
+        raise ValueError(f'Unknown column types: {", ".join(kinds)}')
+    getter = attrgetter(*fields)
+    return type(name, (Record,), {
+        '__slots__': fields,
+        'fields': fields,
+        '_field_set': frozenset(fields),
+        '_interned': frozenset(interned),
+        '_types': {f: TYPES[kind] for f, kind in types.items()},
+        '_values': staticmethod(getter if len(fields) > 1 else lambda record: (getter(record),)),
+    })
+
+
+class RecordJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider that serializes records as plain objects"""
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, Record):
+            return o.to_dict()
+        return DefaultJSONProvider.default(o)
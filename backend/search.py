@@ -0,0 +1,178 @@
+"""In-process full-text search over jobs.
+
+An InvertedIndex maps each token of the searchable columns to the jobs
+containing it, weighted by column (a hit in jobName counts more than one in
+description). It registers as a jobs_table listener, so every job change
+re-indexes just that job and a full reload rebuilds the index; queries
+never scan the table.
+
+Queries are tokenized the same way. Every query term must match, either as
+a whole token or as the prefix of one ("plum" finds "plumbing"), and
+results are ranked by the summed column weights times how rare each
+matched token is. A prefix matching more than MAX_EXPANSIONS tokens only
+matches the most common of them, and the search reports it was truncated.
+"""
+import bisect
+import heapq
+import math
+import re
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Column -> weight of a token found there
+JOB_SEARCH_FIELDS = {
+    'jobName': 3.0,
+    'customerName': 2.0,
+    'city': 2.0,
+    'propertyAddress': 1.5,
+    'description': 1.0,
+}
+
+# Prefix matches rank a little below whole-token matches
+PREFIX_PENALTY = 0.8
+# Shorter query terms only match whole tokens
+MIN_PREFIX_LENGTH = 2
+# Upper bound on tokens one prefix expands to, so "ab" can't touch everything;
+# the ones in the most rows are kept
+MAX_EXPANSIONS = 200
+
+_TOKEN_RE = re.compile(r'[^\W_]+')
+
+
+def tokenize(text: str) -> List[str]:
+    """Lower-cased runs of letters and digits"""
+    return _TOKEN_RE.findall(text.lower()) if text else []
+
+
+class InvertedIndex:
+    """Token -> {row key: weight} postings with a sorted vocabulary for prefixes"""
+
+    def __init__(self, key: str, fields: Dict[str, float]):
+        self.key = key
+        self.fields = dict(fields)
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._postings: Dict[str, Dict[str, float]] = {}
+        self._terms: List[str] = []  # sorted vocabulary
+        self._docs: Dict[str, Dict[str, float]] = {}  # row key -> {token: weight}
+
+    # ---------- table listener ----------
+
+    def on_change(self, old: Optional[Dict], new: Optional[Dict]):
+        """Re-index one row (``new`` None removes it)"""
+        if new is not None and old is not None and all(old.get(f) == new.get(f) for f in self.fields):
+            return  # no searchable column changed
+        with self._lock:
+            if new is None:
+                self._unindex(old[self.key])
+            else:
+                self._index(new)
+
+    def on_reload(self, rows: List[Dict]):
+        """Rebuild the whole index"""
+        with self._lock:
+            self._reset()
+            postings = self._postings
+            for row in rows:
+                key = row[self.key]
+                weights = self._docs[key] = self._weigh(row)
+                for token, weight in weights.items():
+                    posting = postings.get(token)
+                    if posting is None:
+                        posting = postings[token] = {}
+                    posting[key] = weight
+            # One sort instead of an insort per new token
+            self._terms = sorted(postings)
+
+    def _weigh(self, row: Dict) -> Dict[str, float]:
+        """Token -> summed weight of the columns it appears in"""
+        weights: Dict[str, float] = {}
+        for field, weight in self.fields.items():
+            for token in tokenize(row.get(field, '')):
+                weights[token] = weights.get(token, 0.0) + weight
+        return weights
+
+    def _index(self, row: Dict):
+        key = row[self.key]
+        weights = self._weigh(row)
+        if self._docs.get(key) == weights:
+            return
+        self._unindex(key)
+        self._docs[key] = weights
+        for token, weight in weights.items():
+            posting = self._postings.get(token)
+            if posting is None:
+                posting = self._postings[token] = {}
+                bisect.insort(self._terms, token)
+            posting[key] = weight
+
+    def _unindex(self, key: str):
+        for token in self._docs.pop(key, {}):
+            posting = self._postings[token]
+            del posting[key]
+            if not posting:
+                del self._postings[token]
+                del self._terms[bisect.bisect_left(self._terms, token)]
+
+    # ---------- queries ----------
+
+    def _expand(self, term: str) -> Tuple[List[Tuple[str, float]], bool]:
+        """Tokens matching ``term`` with their score factor, and whether
+        some prefix matches were left out"""
+        matches = [(term, 1.0)] if term in self._postings else []
+        if len(term) < MIN_PREFIX_LENGTH:
+            return matches, False
+        # Tokens starting with term sort right after it
+        start = bisect.bisect_right(self._terms, term)
+        end = bisect.bisect_left(self._terms, term[:-1] + chr(ord(term[-1]) + 1), start)
+        prefixed = self._terms[start:end]
+        truncated = len(prefixed) > MAX_EXPANSIONS
+        if truncated:
+            prefixed = heapq.nlargest(MAX_EXPANSIONS, prefixed, key=lambda token: len(self._postings[token]))
+        matches.extend((token, PREFIX_PENALTY) for token in prefixed)
+        return matches, truncated
+
+    def search(self, query: str, limit: int = 20,
+               accept: Optional[Callable[[str], bool]] = None) -> Tuple[List[Tuple[str, float]], int, bool]:
+        """Best ``limit`` (key, score) pairs for ``query`` among rows that
+        ``accept`` lets through, the number of such rows in total, and
+        whether a prefix matched too many tokens for all of them to count"""
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return [], 0, False
+        truncated = False
+        with self._lock:
+            total_docs = max(len(self._docs), 1)
+            per_term = []
+            for term in terms:
+                scores: Dict[str, float] = {}
+                expansions, cut = self._expand(term)
+                truncated = truncated or cut
+                for token, factor in expansions:
+                    posting = self._postings[token]
+                    idf = math.log(1 + total_docs / len(posting))
+                    for key, weight in posting.items():
+                        score = weight * idf * factor
+                        if score > scores.get(key, 0.0):
+                            scores[key] = score
+                if not scores:
+                    return [], 0, False
+                per_term.append(scores)
+
+        # Intersect starting from the rarest term
+        per_term.sort(key=len)
+        first, rest = per_term[0], per_term[1:]
+        matches = {}
+        for key, score in first.items():
+            for scores in rest:
+                other = scores.get(key)
+                if other is None:
+                    break
+                score += other
+            else:
+                if accept is None or accept(key):
+                    matches[key] = score
+        best = heapq.nsmallest(limit, matches.items(), key=lambda item: (-item[1], item[0]))
+        return best, len(matches), truncated
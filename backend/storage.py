@@ -0,0 +1,369 @@
+"""Storage backends behind the resident tables.
+
+CsvBackend is the original flat-file layout, with every table additionally
+journaled (see journal.py). SqliteBackend keeps the same four tables in one SQLite
+database in WAL mode so several worker processes can read and write without
+rewriting whole files. Pick one with APEX_STORAGE=csv|sqlite.
+
+Both backends speak the same small interface: read_all/write_all for whole
+tables, batch() to group writes into one commit, and table_source() which
+feeds a resident store.IndexedTable and persists its changes.
+
+Import existing CSV data into a new database with:
+
+    python storage.py import-csv --db apex.db
+"""
+import argparse
+import csv
+import json
+import os
+import sqlite3
+import threading
+from collections import namedtuple
+from contextlib import ExitStack, contextmanager
+from typing import Dict, List, Optional, Tuple
+
+from journal import JournaledCsv
+from locking import FileLock
+from metrics import row_bytes, storage_op
+from store import DELETED, tombstone
+
+TableSchema = namedtuple('TableSchema', 'csv_path fieldnames key indexes unique interned types',
+                         defaults=((), (), None))
+
+PROFILE_FIELDS = ['profileID', 'email', 'password', 'user_role']
+JOB_FIELDS = [
+    'jobID', 'profileID', 'jobName', 'propertyAddress', 'city',
+    'customerName', 'customerEmail', 'trade', 'estimatedPay',
+    'description', 'scheduledTime', 'squareFootage', 'status',
+    'assignedContractorId', 'materialStatus', 'createdAt',
+    'contractorProgress_currentStep', 'contractorProgress_acknowledged',
+    'contractorProgress_lastUpdated'
+]
+KYC_FIELDS = ['contractorId', 'idPhotoUrl', 'selfieUrl', 'status', 'submittedAt', 'verifiedAt']
+AGREEMENT_FIELDS = ['contractorId', 'agreementId', 'version', 'signedName', 'signedAt']
+
+# key: primary key columns; indexes: columns the routes filter on;
+# unique: columns where no two rows may share a value. For the resident
+# records (records.py): interned: columns with few distinct values;
+# types: columns stored compactly as int or bool
+TABLES = {
+    'profiles': TableSchema('profiles.csv', PROFILE_FIELDS, ('profileID',), (), ('email',),
+                            interned=('user_role',)),
+    'jobs': TableSchema('jobs.csv', JOB_FIELDS, ('jobID',),
+                        ('profileID', 'status', 'assignedContractorId', 'trade'),
+                        interned=('profileID', 'city', 'trade', 'status', 'assignedContractorId',
+                                  'materialStatus'),
+                        types={'estimatedPay': 'int', 'squareFootage': 'int',
+                               'contractorProgress_currentStep': 'int',
+                               'contractorProgress_acknowledged': 'bool'}),
+    'kyc': TableSchema('kyc_submissions.csv', KYC_FIELDS, ('contractorId',), (),
+                       interned=('status',)),
+    'agreements': TableSchema('agreements_signed.csv', AGREEMENT_FIELDS,
+                              ('contractorId', 'agreementId'), ('contractorId',),
+                              interned=('contractorId', 'agreementId', 'version')),
+}
+
+
+def _columns(fields) -> str:
+    return ', '.join(f'"{f}"' for f in fields)
+
+
+class StorageBackend:
+    """Interface shared by the CSV and SQLite backends"""
+
+    def read_all(self, table: str) -> List[Dict]:
+        """Every row of ``table`` in insertion order"""
+        raise NotImplementedError
+
+    def write_all(self, table: str, rows: List[Dict]):
+        """Replace the whole table"""
+        raise NotImplementedError
+
+    def batch(self):
+        """Context manager: writes inside commit together when it exits.
+        Also excludes writers in other processes while it is open."""
+        raise NotImplementedError
+
+    def table_source(self, table: str):
+        """Persistence source for a resident store.IndexedTable"""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+# ==================== CSV ====================
+
+class CsvBackend(StorageBackend):
+    """Flat CSV files in ``directory``, each with a journal of changes"""
+
+    def __init__(self, directory: str = '.'):
+        self.directory = directory
+        # One writer lock for the whole data directory
+        self.lock = FileLock(os.path.join(directory, 'apex.lock'))
+        self._journals: Dict[str, JournaledCsv] = {}
+        for name, schema in TABLES.items():
+            path = self.path(name)
+            # Ensure CSV files exist with headers
+            if not os.path.exists(path):
+                with open(path, 'w', newline='') as f:
+                    csv.writer(f).writerow(schema.fieldnames)
+            self._journals[name] = JournaledCsv(
+                path, os.path.splitext(path)[0] + '.journal',
+                schema.fieldnames, key=schema.key, lock=self.lock, name=name)
+
+    def path(self, table: str) -> str:
+        return os.path.join(self.directory, TABLES[table].csv_path)
+
+    def read_all(self, table):
+        return self._journals[table].load()[0]
+
+    def write_all(self, table, rows):
+        self._journals[table].replace_all(rows)
+
+    @contextmanager
+    def batch(self):
+        with ExitStack() as stack:
+            for journal in self._journals.values():
+                stack.enter_context(journal.batch())
+            yield
+
+    def table_source(self, table):
+        return self._journals[table]
+
+
+# ==================== SQLITE ====================
+
+class SqliteBackend(StorageBackend):
+    """All tables in one SQLite database (WAL mode, one connection per thread)
+
+    Every table carries a ``_rev`` column stamped from a per-table counter in
+    ``_meta`` so resident tables can fetch just the rows written since their
+    last read. Deleted rows leave their key in ``_tombstones`` under the
+    same counter. ``epoch`` changes when a table is replaced wholesale.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        with self.transaction() as conn:
+            self._create_schema(conn)
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # Autocommit mode; transactions are opened explicitly below
+            conn = sqlite3.connect(self.path, isolation_level=None, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.depth = 0
+        return conn
+
+    @contextmanager
+    def transaction(self, mode: str = 'IMMEDIATE'):
+        """One transaction per outermost block; nested blocks join it"""
+        conn = self._connection()
+        if self._local.depth:
+            self._local.depth += 1
+            try:
+                yield conn
+            finally:
+                self._local.depth -= 1
+            return
+        conn.execute(f'BEGIN {mode}')
+        self._local.depth = 1
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        else:
+            conn.execute('COMMIT')
+        finally:
+            self._local.depth = 0
+
+    def _create_schema(self, conn: sqlite3.Connection):
+        conn.execute('CREATE TABLE IF NOT EXISTS _meta ('
+                     'name TEXT PRIMARY KEY, rev INTEGER NOT NULL, epoch INTEGER NOT NULL)')
+        # tombstone: JSON of the delta that removed the row
+        conn.execute('CREATE TABLE IF NOT EXISTS _tombstones ('
+                     'name TEXT NOT NULL, tombstone TEXT NOT NULL, _rev INTEGER NOT NULL)')
+        conn.execute('CREATE INDEX IF NOT EXISTS "_tombstones_rev" ON _tombstones (name, _rev)')
+        for name, schema in TABLES.items():
+            columns = ', '.join(f'"{f}" TEXT NOT NULL DEFAULT \'\'' for f in schema.fieldnames)
+            conn.execute(f'CREATE TABLE IF NOT EXISTS "{name}" ({columns}, '
+                         f'_rev INTEGER NOT NULL DEFAULT 0, PRIMARY KEY ({_columns(schema.key)}))')
+            for field in schema.indexes + ('_rev',):
+                conn.execute(f'CREATE INDEX IF NOT EXISTS "{name}_{field}" ON "{name}" ("{field}")')
+            for field in schema.unique:
+                conn.execute(f'DROP INDEX IF EXISTS "{name}_{field}"')
+                conn.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS "{name}_{field}_key" ON "{name}" ("{field}")')
+            conn.execute('INSERT OR IGNORE INTO _meta (name, rev, epoch) VALUES (?, 0, 0)', (name,))
+
+    def _bump(self, conn: sqlite3.Connection, table: str, new_epoch: bool = False) -> int:
+        conn.execute('UPDATE _meta SET rev = rev + 1, epoch = epoch + ? WHERE name = ?',
+                     (1 if new_epoch else 0, table))
+        return conn.execute('SELECT rev FROM _meta WHERE name = ?', (table,)).fetchone()[0]
+
+    def _select(self, conn, table: str, where: str = '', params=()) -> List[Dict]:
+        cursor = conn.execute(f'SELECT {_columns(TABLES[table].fieldnames)} FROM "{table}" {where} ORDER BY rowid', params)
+        return [dict(r) for r in cursor]
+
+    def read_all(self, table):
+        with storage_op(table, 'load') as op:
+            rows = self._select(self._connection(), table)
+            op.rows = len(rows)
+            return rows
+
+    def write_all(self, table, rows):
+        fields = TABLES[table].fieldnames
+        with storage_op(table, 'replace') as op, self.transaction() as conn:
+            op.rows = len(rows)
+            op.bytes_written = row_bytes(rows)
+            rev = self._bump(conn, table, new_epoch=True)
+            conn.execute(f'DELETE FROM "{table}"')
+            # A new epoch makes readers reload, so old tombstones are moot
+            conn.execute('DELETE FROM _tombstones WHERE name = ?', (table,))
+            conn.executemany(
+                f'INSERT INTO "{table}" ({_columns(fields)}, _rev) VALUES ({", ".join("?" * len(fields))}, ?)',
+                (['' if r.get(f) is None else str(r.get(f)) for f in fields] + [rev] for r in rows))
+
+    def upsert(self, table, rows) -> int:
+        schema = TABLES[table]
+        with storage_op(table, 'upsert') as op, self.transaction() as conn:
+            op.rows = len(rows)
+            op.bytes_written = row_bytes(rows)
+            rev = self._bump(conn, table)
+            for row in rows:
+                fields = [f for f in schema.fieldnames if f in row]
+                updates = ', '.join(f'"{f}" = excluded."{f}"' for f in fields if f not in schema.key)
+                conn.execute(
+                    f'INSERT INTO "{table}" ({_columns(fields)}, _rev) VALUES ({", ".join("?" * len(fields))}, ?) '
+                    f'ON CONFLICT ({_columns(schema.key)}) DO UPDATE SET {updates + ", " if updates else ""}'
+                    f'_rev = excluded._rev',
+                    [str(row[f]) for f in fields] + [rev])
+        return rev
+
+    def delete(self, table, rows) -> int:
+        key = TABLES[table].key
+        where = ' AND '.join(f'"{f}" = ?' for f in key)
+        with storage_op(table, 'delete') as op, self.transaction() as conn:
+            op.rows = len(rows)
+            rev = self._bump(conn, table)
+            for row in rows:
+                conn.execute(f'DELETE FROM "{table}" WHERE {where}', [str(row[f]) for f in key])
+                conn.execute('INSERT INTO _tombstones (name, tombstone, _rev) VALUES (?, ?, ?)',
+                             (table, json.dumps(tombstone(key, row)), rev))
+        return rev
+
+    def batch(self):
+        return self.transaction()
+
+    def table_source(self, table):
+        return SqliteTableSource(self, table)
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class SqliteTableSource:
+    """IndexedTable source reading incremental changes via the _rev column"""
+
+    def __init__(self, backend: SqliteBackend, table: str):
+        self.backend = backend
+        self.table = table
+        self.fieldnames = TABLES[table].fieldnames
+
+    def _meta(self, conn) -> Tuple[int, int]:
+        row = conn.execute('SELECT epoch, rev FROM _meta WHERE name = ?', (self.table,)).fetchone()
+        return row[0], row[1]
+
+    def load(self):
+        with storage_op(self.table, 'load') as op, self.backend.transaction('DEFERRED') as conn:
+            cursor = self._meta(conn)
+            rows = self.backend._select(conn, self.table)
+            op.rows = len(rows)
+            return rows, cursor
+
+    def changes(self, cursor):
+        conn = self.backend._connection()
+        epoch, rev = self._meta(conn)
+        if epoch != cursor[0]:
+            return None
+        if rev <= cursor[1]:
+            # Nothing new; behind us only while our own transaction is open
+            return [], cursor
+        with storage_op(self.table, 'changes') as op, self.backend.transaction('DEFERRED') as conn:
+            epoch, rev = self._meta(conn)
+            if epoch != cursor[0]:
+                return None
+            # Tombstones first: a row deleted and then written again is
+            # back in the table with a later _rev
+            deltas = [json.loads(t) for (t,) in conn.execute(
+                'SELECT tombstone FROM _tombstones WHERE name = ? AND _rev > ? ORDER BY _rev',
+                (self.table, cursor[1]))]
+            deltas += self.backend._select(conn, self.table, 'WHERE _rev > ?', (cursor[1],))
+            op.rows = len(deltas)
+            return deltas, (epoch, rev)
+
+    def append(self, deltas, cursor):
+        deleted = [d for d in deltas if d.get(DELETED)]
+        if not deleted:
+            rev = self.backend.upsert(self.table, deltas)
+        elif len(deleted) == len(deltas):
+            rev = self.backend.delete(self.table, deltas)
+        else:
+            with self.backend.transaction():
+                self.backend.upsert(self.table, [d for d in deltas if not d.get(DELETED)])
+                self.backend.delete(self.table, deleted)
+            return cursor  # two revisions: let changes() replay them
+        # Only skip past our own write if nobody else wrote in between
+        if cursor is not None and cursor[1] == rev - 1:
+            return cursor[0], rev
+        return cursor
+
+    def replace_all(self, rows):
+        self.backend.write_all(self.table, rows)
+
+    def batch(self):
+        return self.backend.transaction()
+
+
+def open_backend(kind: Optional[str] = None) -> StorageBackend:
+    """Backend selected by APEX_STORAGE (csv by default)"""
+    kind = kind or os.environ.get('APEX_STORAGE', 'csv')
+    if kind == 'csv':
+        return CsvBackend(os.environ.get('APEX_DATA_DIR', '.'))
+    if kind == 'sqlite':
+        return SqliteBackend(os.environ.get('APEX_SQLITE_PATH', 'apex.db'))
+    raise ValueError(f'Unknown storage backend: {kind}')
+
+
+def import_csv(source: CsvBackend, target: SqliteBackend):
+    """Copy every table from CSV files into SQLite in one transaction"""
+    counts = {}
+    with target.transaction():
+        for table in TABLES:
+            rows = source.read_all(table)
+            target.write_all(table, rows)
+            counts[table] = len(rows)
+    return counts
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Apex portal storage tools')
+    sub = parser.add_subparsers(dest='command', required=True)
+    import_cmd = sub.add_parser('import-csv', help='Load the CSV files into a SQLite database')
+    import_cmd.add_argument('--csv-dir', default='.', help='Directory holding the CSV files')
+    import_cmd.add_argument('--db', default='apex.db', help='SQLite database to create or overwrite')
+    args = parser.parse_args()
+
+    counts = import_csv(CsvBackend(args.csv_dir), SqliteBackend(args.db))
+    for table, count in counts.items():
+        print(f'{table}: {count} rows')
@@ -0,0 +1,519 @@
+"""Resident, indexed copies of the CSV tables.
+
+Handlers used to call read_jobs() and scan the whole result on every request.
+An IndexedTable loads the rows once, keeps hash indexes on the columns the
+routes filter by, and afterwards only reads what other processes have
+written since (see journal.py for the on-disk side).
+"""
+import bisect
+import hashlib
+import os
+import threading
+from typing import AbstractSet, Callable, Dict, Iterable, Iterator, List, Mapping, Optional, Sequence, Tuple, Union
+
+
+def file_signature(path: str) -> Optional[Tuple[int, int, int]]:
+    """Cheap identity of a file on disk, used to detect external changes"""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+# A delta carrying this field removes its row instead of updating it
+DELETED = '_deleted'
+
+
+def tombstone(key_fields: Sequence[str], row: Mapping) -> Dict:
+    """Delta that removes ``row``: its key columns plus the DELETED mark"""
+    delta = {f: row[f] for f in key_fields}
+    delta[DELETED] = True
+    return delta
+
+
+class UniqueViolation(ValueError):
+    """A put() would give two rows the same value in a unique column"""
+
+    def __init__(self, field: str, value: str):
+        super().__init__(f'{field} already exists: {value}')
+        self.field = field
+        self.value = value
+
+
+class _Top:
+    """Sorts after every other value, for bisecting past all keys of a value"""
+
+    def __lt__(self, other):
+        return False
+
+    def __gt__(self, other):
+        return True
+
+
+_TOP = _Top()
+
+
+class SortedIndex:
+    """(value, key) pairs kept in order for keyset pagination and ranges
+
+    ``value`` may return None for rows without a usable value; those are
+    kept apart and come after all others in either direction, ordered by
+    key, as ``(None, key)`` entries.
+    """
+
+    def __init__(self, value: Callable[[Dict], object]):
+        self.value = value
+        self._entries: List[Tuple[object, str]] = []
+        self._missing: List[str] = []
+
+    @classmethod
+    def build(cls, value: Callable[[Dict], object], rows: Iterable[Tuple[str, Dict]]) -> 'SortedIndex':
+        """Index over (key, row) pairs, sorted once instead of per insert"""
+        index = cls(value)
+        for key, row in rows:
+            v = value(row)
+            if v is None:
+                index._missing.append(key)
+            else:
+                index._entries.append((v, key))
+        index._entries.sort()
+        index._missing.sort()
+        return index
+
+    def add(self, key: str, row: Dict):
+        v = self.value(row)
+        if v is None:
+            bisect.insort(self._missing, key)
+        else:
+            bisect.insort(self._entries, (v, key))
+
+    def remove(self, key: str, row: Dict):
+        v = self.value(row)
+        items, item = (self._missing, key) if v is None else (self._entries, (v, key))
+        i = bisect.bisect_left(items, item)
+        if i < len(items) and items[i] == item:
+            del items[i]
+
+    def clear(self):
+        self._entries = []
+        self._missing = []
+
+    def scan(self, after: Optional[Tuple[object, str]] = None, lo=None, hi=None,
+             reverse: bool = False) -> Iterator[Tuple[object, str]]:
+        """Entries strictly after the ``after`` cursor in the chosen direction.
+        With ``lo``/``hi`` only values in [lo, hi] are produced, otherwise
+        rows without a value follow the rest."""
+        entries = self._entries
+        if after is not None and after[0] is None:
+            pass  # the cursor is already among the valueless rows
+        elif not reverse:
+            i = 0 if lo is None else bisect.bisect_left(entries, (lo,))
+            if after is not None:
+                i = max(i, bisect.bisect_right(entries, tuple(after)))
+            while i < len(entries) and (hi is None or entries[i][0] <= hi):
+                yield entries[i]
+                i += 1
+        else:
+            i = len(entries) if hi is None else bisect.bisect_right(entries, (hi, _TOP))
+            if after is not None:
+                i = min(i, bisect.bisect_left(entries, tuple(after)))
+            while i > 0 and (lo is None or entries[i - 1][0] >= lo):
+                i -= 1
+                yield entries[i]
+        if lo is None and hi is None:
+            missing = self._missing
+            i = 0 if after is None or after[0] is not None else bisect.bisect_right(missing, after[1])
+            for key in missing[i:]:
+                yield None, key
+
+    def __len__(self) -> int:
+        return len(self._entries) + len(self._missing)
+
+
+class IndexedTable:
+    """In-memory table keyed by one or more columns with hash indexes on others
+
+    ``source`` persists the rows (journal.JournaledCsv or
+    storage.SqliteTableSource): load() returns every row plus a cursor,
+    changes(cursor) returns the deltas written since then (None when a full
+    reload is needed), append(deltas, cursor) durably records new deltas and
+    replace_all(rows) swaps the whole table. A delta marked DELETED (see
+    tombstone()) removes its row.
+
+    With several ``key`` columns, row keys are tuples of their values, as in
+    journal.JournaledCsv.
+
+    Columns listed in ``unique`` additionally map each value to exactly one
+    row; put() refuses to create duplicates there and lookup() resolves them.
+
+    ``orderings`` maps a name to a function computing a row's sort value;
+    each gets a SortedIndex so page() can resume after a (value, key) cursor.
+
+    ``record`` builds the resident form of a row from a mapping of its
+    values (e.g. a records.record_type() class); rows stay plain dicts
+    without it.
+
+    Listeners registered with add_listener() hear about every row change,
+    whether it was written here or picked up from another process.
+    """
+
+    def __init__(self, key: Union[str, Sequence[str]], indexes: Iterable[str], source,
+                 orderings: Optional[Dict[str, Callable[[Dict], object]]] = None,
+                 unique: Iterable[str] = (), record: Optional[Callable[[Mapping], Mapping]] = None):
+        self.key = key
+        self.key_fields = (key,) if isinstance(key, str) else tuple(key)
+        self.index_fields = tuple(indexes)
+        self.unique_fields = tuple(unique)
+        self.source = source
+        self.record = record
+        self.orderings = {name: SortedIndex(fn) for name, fn in (orderings or {}).items()}
+        self._lock = threading.RLock()
+        self._rows: Dict[str, Dict] = {}
+        # Insertion sequence per key so filtered results keep file order
+        self._pos: Dict[str, int] = {}
+        self._next_pos = 0
+        self._indexes: Dict[str, Dict[str, Dict[str, None]]] = {}
+        self._unique: Dict[str, Dict[str, str]] = {}
+        self._cursor = None
+        # Bumped on every row change; _synced is its value when the rows
+        # last matched storage at _cursor exactly
+        self._version = 0
+        self._synced = 0
+        self._listeners: List[Tuple[Callable, Optional[Callable]]] = []
+
+    def row_key(self, row: Dict):
+        """Primary key of a row (a tuple for composite keys)"""
+        if len(self.key_fields) == 1:
+            return row[self.key_fields[0]]
+        return tuple(row[f] for f in self.key_fields)
+
+    # ---------- loading ----------
+
+    def refresh(self):
+        """Catch up with writes made by other processes since our last read"""
+        with self._lock:
+            changes = None if self._cursor is None else self.source.changes(self._cursor)
+            if changes is None:
+                rows, self._cursor = self.source.load()
+                self._rebuild(rows)
+                return
+            deltas, cursor = changes
+            for delta in deltas:
+                self._apply(delta)
+            if cursor != self._cursor:
+                self._cursor, self._synced = cursor, self._version
+
+    def _rebuild(self, rows: List[Dict]):
+        self._rows = {}
+        self._pos = {}
+        self._next_pos = 0
+        self._version = 0
+        self._indexes = {field: {} for field in self.index_fields}
+        self._unique = {field: {} for field in self.unique_fields}
+        record = self.record
+        for row in rows:
+            self._insert(row if record is None else record(row), ordered=False)
+        self._synced = self._version
+        # Sorting once is far cheaper than an insort per row
+        self.orderings = {name: SortedIndex.build(ordering.value, self._rows.items())
+                          for name, ordering in self.orderings.items()}
+        for _, on_reload in self._listeners:
+            if on_reload is not None:
+                on_reload(list(self._rows.values()))
+
+    def add_listener(self, on_change: Callable[[Optional[Dict], Optional[Dict]], None],
+                     on_reload: Optional[Callable[[List[Dict]], None]] = None):
+        """Call on_change(old_row, new_row) after each row change (new_row
+        None when the row was deleted) and on_reload(rows) after the table
+        was rebuilt from scratch.
+
+        Both run under the table lock, in commit order; keep them quick.
+        """
+        with self._lock:
+            self._listeners.append((on_change, on_reload))
+
+    def _apply(self, delta: Dict):
+        key = self.row_key(delta)
+        old = self._rows.get(key)
+        if delta.get(DELETED):
+            if old is None:
+                return  # already gone, e.g. our own delete replayed
+            self._remove(key)
+            del self._pos[key]
+            self._version += 1
+            for on_change, _ in self._listeners:
+                on_change(old, None)
+            return
+        if old is None:
+            row = dict.fromkeys(self.source.fieldnames, '')
+            row.update(delta)
+        else:
+            # Build a new row: rows handed out earlier stay unchanged
+            row = {**old, **delta}
+        if self.record is not None:
+            row = self.record(row)
+        if row == old:
+            return  # e.g. our own write replayed from the journal
+        self._insert(row)
+        for on_change, _ in self._listeners:
+            on_change(old, row)
+
+    def _insert(self, row: Dict, ordered: bool = True):
+        key = self.row_key(row)
+        if key in self._rows:
+            self._remove(key)
+        else:
+            self._pos[key] = self._next_pos
+            self._next_pos += 1
+        self._rows[key] = row
+        self._version += 1
+        for field in self.index_fields:
+            self._indexes[field].setdefault(row.get(field, ''), {})[key] = None
+        for field in self.unique_fields:
+            self._unique[field][row.get(field, '')] = key
+        if ordered:
+            for ordering in self.orderings.values():
+                ordering.add(key, row)
+
+    def _remove(self, key: str):
+        row = self._rows.pop(key)
+        for field in self.index_fields:
+            bucket = self._indexes[field].get(row.get(field, ''))
+            if bucket is not None:
+                bucket.pop(key, None)
+                if not bucket:
+                    del self._indexes[field][row.get(field, '')]
+        for field in self.unique_fields:
+            if self._unique[field].get(row.get(field, '')) == key:
+                del self._unique[field][row.get(field, '')]
+        for ordering in self.orderings.values():
+            ordering.remove(key, row)
+
+    # ---------- queries ----------
+    # Returned rows are the resident objects: treat them as read-only and
+    # go through put() to change anything.
+
+    def get(self, key: str) -> Optional[Dict]:
+        """Look up one row by primary key"""
+        self.refresh()
+        return self._rows.get(key)
+
+    def lookup(self, field: str, value: str) -> Optional[Dict]:
+        """The row holding ``value`` in unique column ``field``"""
+        with self._lock:
+            self.refresh()
+            key = self._unique[field].get(value)
+            return None if key is None else self._rows[key]
+
+    def all(self) -> List[Dict]:
+        """All rows in file order"""
+        with self._lock:
+            self.refresh()
+            return list(self._rows.values())
+
+    def chunks(self, size: int = 1000) -> Iterator[List[Dict]]:
+        """All rows in file order, ``size`` at a time. The lock is held only
+        while a chunk is copied out; rows deleted meanwhile are skipped and
+        rows changed meanwhile come back in their new state."""
+        with self._lock:
+            self.refresh()
+            keys = list(self._rows)
+        for start in range(0, len(keys), size):
+            with self._lock:
+                rows = self._rows
+                chunk = [rows[k] for k in keys[start:start + size] if k in rows]
+            yield chunk
+
+    def find(self, **filters: str) -> List[Dict]:
+        """Rows whose indexed columns equal every given value, in file order"""
+        filters = {f: v for f, v in filters.items() if v}
+        if not filters:
+            return self.all()
+        with self._lock:
+            self.refresh()
+            keys = sorted(self._matching(filters), key=self._pos.__getitem__)
+            return [self._rows[k] for k in keys]
+
+    def get_many(self, keys: Iterable) -> Dict[object, Dict]:
+        """Rows by primary key for every key that exists, read after a
+        single refresh"""
+        with self._lock:
+            self.refresh()
+            rows = self._rows
+            return {k: rows[k] for k in keys if k in rows}
+
+    def group(self, field: str, values: Iterable[str]) -> Dict[str, List[Dict]]:
+        """Rows holding each of ``values`` in indexed column ``field``, in
+        file order, read after a single refresh"""
+        if field not in self.index_fields:
+            raise KeyError(f'Not an indexed field: {field}')
+        with self._lock:
+            self.refresh()
+            index, rows, pos = self._indexes[field], self._rows, self._pos
+            return {v: [rows[k] for k in sorted(index.get(v, ()), key=pos.__getitem__)]
+                    for v in values}
+
+    def keys(self, **filters: str) -> set:
+        """Primary keys of the rows whose indexed columns equal every given value"""
+        filters = {f: v for f, v in filters.items() if v}
+        with self._lock:
+            self.refresh()
+            return set(self._matching(filters) if filters else self._rows)
+
+    def page(self, order: str, after: Optional[Tuple[object, str]] = None,
+             limit: Optional[int] = 100, reverse: bool = False, lo=None, hi=None,
+             where: Optional[Callable[[Dict], bool]] = None,
+             **filters: str) -> Tuple[List[Dict], Optional[Tuple[object, str]]]:
+        """Up to ``limit`` matching rows sorted by ``order`` (all of them for
+        None), strictly after the ``after`` cursor, optionally restricted to
+        sort values in [lo, hi] and to rows ``where`` accepts. Returns (rows,
+        cursor of the next page or None).
+
+        The ordered index is walked from the cursor, so the first page of a
+        top-K query touches about K entries, not the whole table.
+        """
+        filters = {f: v for f, v in filters.items() if v}
+        with self._lock:
+            self.refresh()
+            ordering = self.orderings[order]
+            if filters:
+                candidates = self._matching(filters)
+                # Walking the ordered index costs about limit * N / matches
+                # steps, sorting the matches about matches * log(matches)
+                if limit is not None and limit * len(ordering) < len(candidates) ** 2:
+                    entries = (e for e in ordering.scan(after, lo, hi, reverse) if e[1] in candidates)
+                else:
+                    subset = SortedIndex.build(ordering.value, ((k, self._rows[k]) for k in candidates))
+                    entries = subset.scan(after, lo, hi, reverse)
+            else:
+                entries = ordering.scan(after, lo, hi, reverse)
+            if where is not None:
+                rows = self._rows
+                entries = (e for e in entries if where(rows[e[1]]))
+            page = []
+            for entry in entries:
+                if len(page) == limit:
+                    return [self._rows[k] for _, k in page], page[-1]
+                page.append(entry)
+            return [self._rows[k] for _, k in page], None
+
+    def _matching(self, filters: Dict[str, str]) -> AbstractSet[str]:
+        """Keys matching every equality filter, by intersecting index buckets"""
+        unknown = [f for f in filters if f not in self.index_fields]
+        if unknown:
+            raise KeyError(f'Not an indexed field: {", ".join(unknown)}')
+        buckets = [self._indexes[f].get(v, {}) for f, v in filters.items()]
+        buckets.sort(key=len)
+        # Key views intersect as sets, smallest first
+        keys = buckets[0].keys()
+        for bucket in buckets[1:]:
+            keys = keys & bucket.keys()
+        return keys
+
+    def __len__(self) -> int:
+        self.refresh()
+        return len(self._rows)
+
+    def version(self) -> Tuple[object, int]:
+        """Changes whenever any row changes; read it before reading rows.
+        Every process caught up to the same point in storage reports the
+        same version: the storage cursor, plus how many of our own changes
+        it doesn't cover yet (e.g. inside an uncommitted batch)."""
+        with self._lock:
+            self.refresh()
+            return self._cursor, self._version - self._synced
+
+    def record_version(self, key: str) -> Optional[str]:
+        """Digest of row ``key``, the same in every process; None if there
+        is no such row"""
+        with self._lock:
+            self.refresh()
+            row = self._rows.get(key)
+        if row is None:
+            return None
+        return hashlib.sha1(repr(sorted(row.items())).encode()).hexdigest()[:16]
+
+    # ---------- mutations ----------
+
+    def put(self, *rows: Dict):
+        """Insert or replace rows, journaling only the fields that changed
+
+        Runs inside source.batch(), which holds the writer lock (or SQLite
+        transaction) and commits when the outermost batch ends.
+        """
+        with self.source.batch(), self._lock:
+            self.refresh()
+            deltas = []
+            claimed = {field: {} for field in self.unique_fields}
+            for row in rows:
+                # Store values the way the CSV would hand them back
+                row = {f: '' if v is None else str(v) for f, v in row.items()}
+                key = self.row_key(row)
+                for field in self.unique_fields:
+                    if field in row:
+                        value = row[field]
+                        owner = claimed[field].get(value, self._unique[field].get(value))
+                        if owner is not None and owner != key:
+                            raise UniqueViolation(field, value)
+                        claimed[field][value] = key
+                old = self._rows.get(key)
+                if old is None:
+                    delta = row
+                else:
+                    delta = {f: v for f, v in row.items() if old.get(f) != v}
+                    if not delta:
+                        continue
+                    delta.update((f, row[f]) for f in self.key_fields)
+                deltas.append(delta)
+            if not deltas:
+                return
+            try:
+                cursor = self.source.append(deltas, self._cursor)
+                for delta in deltas:
+                    self._apply(delta)
+                if cursor != self._cursor:
+                    self._cursor, self._synced = cursor, self._version
+            except Exception:
+                self.invalidate()
+                raise
+
+    def delete(self, *rows: Dict) -> List[Dict]:
+        """Remove rows that are still exactly as given and return them.
+        Rows changed or removed since the caller read them are left alone.
+
+        Runs inside source.batch() like put().
+        """
+        with self.source.batch(), self._lock:
+            self.refresh()
+            removed = []
+            for row in rows:
+                current = self._rows.get(self.row_key(row))
+                if current is not None and current == row:
+                    removed.append(current)
+            if not removed:
+                return []
+            deltas = [tombstone(self.key_fields, row) for row in removed]
+            try:
+                cursor = self.source.append(deltas, self._cursor)
+                for delta in deltas:
+                    self._apply(delta)
+                if cursor != self._cursor:
+                    self._cursor, self._synced = cursor, self._version
+            except Exception:
+                self.invalidate()
+                raise
+            return removed
+
+    def replace_all(self, rows: List[Dict]):
+        """Swap the whole table for ``rows``"""
+        with self.source.batch(), self._lock:
+            self.source.replace_all(rows)
+            self._cursor = None
+            self.refresh()
+
+    def invalidate(self):
+        """Forget the resident rows; the next read reloads from storage.
+        Used when a commit failed after rows were already applied here."""
+        with self._lock:
+            self._cursor = None
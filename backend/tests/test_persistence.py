@@ -0,0 +1,187 @@
+"""Crash recovery, compaction and cross-process visibility of stored tables"""
+import json
+import os
+import subprocess
+import sys
+import threading
+
+import pytest
+
+from journal import JournaledCsv
+from store import IndexedTable
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIELDS = ['id', 'v', 'w']
+
+
+def open_table(directory) -> IndexedTable:
+    """A loaded table over t.csv and t.journal in ``directory``"""
+    source = JournaledCsv(os.path.join(directory, 't.csv'), os.path.join(directory, 't.journal'),
+                          FIELDS, 'id', compact_bytes=1 << 30)
+    table = IndexedTable('id', ['v'], source)
+    table.refresh()
+    return table
+
+
+def values(table: IndexedTable):
+    return {row['id']: dict(row) for row in table.all()}
+
+
+def test_replay_drops_truncated_last_line(tmp_path):
+    table = open_table(tmp_path)
+    table.put({'id': '1', 'v': 'a', 'w': 'x'}, {'id': '2', 'v': 'b', 'w': 'y'})
+    journal = tmp_path / 't.journal'
+    complete = journal.stat().st_size
+    with open(journal, 'ab') as f:
+        f.write(b'{"id":"1","v":"to')  # the process died mid-append
+
+    reopened = open_table(tmp_path)
+    assert journal.stat().st_size == complete
+    assert values(reopened) == values(table)
+
+    # Appends after recovery start on a line of their own
+    reopened.put({'id': '1', 'v': 'c'})
+    assert open_table(tmp_path).get('1') == {'id': '1', 'v': 'c', 'w': 'x'}
+
+
+def test_compaction_while_appending(tmp_path):
+    writer = open_table(tmp_path)
+    reader = open_table(tmp_path)
+    done = threading.Event()
+
+    def compact():
+        while not done.is_set():
+            writer.source.compact()
+
+    compactor = threading.Thread(target=compact)
+    compactor.start()
+    try:
+        for i in range(1000):
+            writer.put({'id': str(i % 50), 'v': str(i), 'w': str(i % 7)})
+            if i % 10 == 0:
+                reader.refresh()
+    finally:
+        done.set()
+        compactor.join()
+    reader.refresh()
+
+    expected = {str(k): {'id': str(k), 'v': str(950 + k), 'w': str((950 + k) % 7)} for k in range(50)}
+    assert values(writer) == expected
+    assert values(reader) == expected
+    assert values(open_table(tmp_path)) == expected
+
+
+FOLLOWER = '''
+import json, sys
+sys.path.insert(0, {backend!r})
+from journal import JournaledCsv
+from store import IndexedTable
+table = IndexedTable('id', ['v'], JournaledCsv('t.csv', 't.journal', {fields!r}, 'id'))
+table.refresh()
+reloads = []
+table.add_listener(lambda old, new: None, reloads.append)
+print(json.dumps(table.get('1')), flush=True)
+sys.stdin.readline()
+table.refresh()
+print(json.dumps([table.get('1'), table.get('2'), len(reloads)]), flush=True)
+'''
+
+
+def test_delete_then_put_replays_in_another_process(tmp_path):
+    table = open_table(tmp_path)
+    table.put({'id': '1', 'v': 'a', 'w': 'x'}, {'id': '2', 'v': 'b', 'w': 'y'})
+    follower = subprocess.Popen([sys.executable, '-c', FOLLOWER.format(backend=BACKEND, fields=FIELDS)],
+                                cwd=tmp_path, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+    try:
+        assert json.loads(follower.stdout.readline()) == {'id': '1', 'v': 'a', 'w': 'x'}
+        # The first pair is folded into the snapshot before the follower
+        # reads it, the second is still in the journal
+        table.delete(table.get('1'))
+        table.put({'id': '1', 'v': 'c'})
+        table.source.compact()
+        table.delete(table.get('2'))
+        table.put({'id': '2', 'v': 'd'})
+        out, _ = follower.communicate('\n', timeout=60)
+    finally:
+        if follower.poll() is None:
+            follower.kill()
+    row1, row2, reloads = json.loads(out)
+
+    # Re-put rows don't bring back fields from before the delete
+    assert row1 == {'id': '1', 'v': 'c', 'w': ''}
+    assert row2 == {'id': '2', 'v': 'd', 'w': ''}
+    assert reloads == 0  # carried over the compaction, not reloaded
+    assert values(open_table(tmp_path)) == {'1': row1, '2': row2}
+
+
+APP = '''
+import json, sys, time
+sys.path.insert(0, {backend!r})
+import main
+client = main.app.test_client()
+job = dict(profileID='customer-001', jobName='j', propertyAddress='a', city='c', customerName='n',
+           customerEmail='e', trade='t', estimatedPay='1', description='d')
+mode = sys.argv[1]
+if mode == 'create':
+    ids = [client.post('/api/jobs', json=job).get_json()['job']['jobID'] for _ in range(5)]
+    print(json.dumps(ids))
+elif mode == 'dump':
+    print(json.dumps(client.get('/api/jobs?limit=1000').get_json()))
+else:
+    ids = json.loads(sys.stdin.readline())
+    def slow_get(key, get=main.jobs_table.get):
+        # Widen the window between reading a job and writing it back
+        row = get(key)
+        time.sleep(0.002)
+        return row
+    main.jobs_table.get = slow_get
+    print('ready', flush=True)
+    sys.stdin.readline()
+    for job_id in (ids * 40 if mode == 'assign' else ids):
+        if mode == 'assign':
+            r = client.post(f'/api/jobs/{{job_id}}/assign', json={{'contractorId': 'contractor-001'}})
+        else:
+            r = client.put(f'/api/jobs/{{job_id}}', json={{'description': 'edited'}})
+        assert r.status_code == 200, r.get_json()
+main.commits.close()
+'''
+
+
+@pytest.mark.parametrize('storage', ['csv', 'sqlite'])
+def test_concurrent_assign_loses_no_update(tmp_path, storage):
+    env = dict(os.environ, APEX_STORAGE=storage, APEX_ARCHIVE_INTERVAL_S='0', APEX_ADMISSION='off')
+    script = APP.format(backend=BACKEND)
+
+    def app(mode, **kwargs):
+        return subprocess.Popen([sys.executable, '-c', script, mode], cwd=tmp_path, env=env,
+                                stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True, **kwargs)
+
+    out, _ = app('create').communicate(timeout=120)
+    ids = json.loads(out)
+    # One process keeps assigning the jobs while another edits each once;
+    # both read a job before writing it back, so an assignment based on a
+    # read from before the edit would undo it
+    workers = [app('assign'), app('edit')]
+    try:
+        for worker in workers:
+            worker.stdin.write(json.dumps(ids) + '\n')
+            worker.stdin.flush()
+        for worker in workers:
+            assert worker.stdout.readline() == 'ready\n'
+        for worker in workers:
+            worker.stdin.write('\n')
+            worker.stdin.flush()
+        for worker in workers:
+            worker.communicate(timeout=120)
+            assert worker.returncode == 0
+    finally:
+        for worker in workers:
+            if worker.poll() is None:
+                worker.kill()
+
+    out, _ = app('dump').communicate(timeout=120)
+    jobs = {job['jobID']: job for job in json.loads(out)}
+    assert set(jobs) == set(ids)
+    for job in jobs.values():
+        assert (job['assignedContractorId'], job['status'], job['description']) == \
+            ('contractor-001', 'InProgress', 'edited')
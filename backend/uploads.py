@@ -0,0 +1,204 @@
+"""Content-addressed storage for uploaded KYC photos.
+
+Uploads are copied to disk in fixed-size chunks while being hashed, and
+stored as ``<sha256>.<ext>``: a contractor resubmitting the same photo
+reuses the file already on disk instead of adding another copy. Anything
+over ``max_bytes`` is rejected part way through the copy.
+
+Post-processing (EXIF stripping, review thumbnails) runs on a small thread
+pool with a bounded backlog so request threads never wait on image work.
+Processing is idempotent and keyed by the file name; when the backlog is
+full the work is skipped and done on demand by ensure_processed() instead.
+It needs Pillow, which is optional: without it photos are stored as-is.
+HEIC is refused: Pillow can't read it, so its metadata couldn't be stripped.
+"""
+import hashlib
+import logging
+import os
+import re
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Optional
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional
+    Image = None
+
+CHUNK_SIZE = 64 * 1024
+DEFAULT_MAX_BYTES = int(os.environ.get('APEX_MAX_UPLOAD_BYTES', 15 * 1024 * 1024))
+DEFAULT_WORKERS = int(os.environ.get('APEX_UPLOAD_WORKERS', 2))
+DEFAULT_BACKLOG = int(os.environ.get('APEX_UPLOAD_BACKLOG', 64))
+THUMBNAIL_SIZE = (320, 320)
+# Re-encoding quality for JPEGs whose own quantization tables can't be kept
+JPEG_QUALITY = 95
+
+logger = logging.getLogger(__name__)
+
+# <sha256>.<ext> as produced by UploadStore.save(); HEIC files stored before
+# HEIC uploads were refused can still be served
+_NAME_RE = re.compile(r'[0-9a-f]{64}\.(jpg|png|gif|webp|heic)')
+
+# Leading bytes of the image formats phones and browsers produce
+_SIGNATURES = (
+    (b'\xff\xd8\xff', 'jpg'),
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'GIF8', 'gif'),
+)
+
+
+class UploadTooLarge(ValueError):
+    """An upload went over the size cap"""
+
+
+class UnsupportedUpload(ValueError):
+    """An upload is not an image format we accept"""
+
+
+def is_upload_name(name: str) -> bool:
+    """Whether ``name`` is a stored upload's name (and safe as a path part)"""
+    return _NAME_RE.fullmatch(name) is not None
+
+
+def sniff_extension(head: bytes) -> Optional[str]:
+    """File extension for the image format starting with ``head``"""
+    for signature, ext in _SIGNATURES:
+        if head.startswith(signature):
+            return ext
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+
+class UploadStore:
+    """Deduplicated photo files in ``directory`` plus derived thumbnails"""
+
+    def __init__(self, directory: str, max_bytes: int = DEFAULT_MAX_BYTES,
+                 workers: int = DEFAULT_WORKERS, backlog: int = DEFAULT_BACKLOG):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='upload')
+        self._slots = threading.BoundedSemaphore(backlog)
+        self._lock = threading.Lock()
+        self._pending = set()
+        # Photos processing failed for once, served unprocessed from then on
+        self._failed = set()
+
+    def path(self, name: str) -> str:
+        """Where the stored file ``name`` lives"""
+        return os.path.join(self.directory, name)
+
+    def thumbnail_path(self, name: str) -> str:
+        return os.path.join(self.directory, os.path.splitext(name)[0] + '.thumb.jpg')
+
+    # ---------- storing ----------
+
+    def save(self, stream: BinaryIO) -> str:
+        """Copy an upload to disk and return its content-addressed name"""
+        digest = hashlib.sha256()
+        tmp_path = os.path.join(self.directory, f'.{uuid.uuid4().hex}.tmp')
+        size = 0
+        ext = None
+        try:
+            with open(tmp_path, 'wb') as f:
+                while True:
+                    chunk = stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    if ext is None:
+                        ext = sniff_extension(chunk)
+                        if ext is None:
+                            raise UnsupportedUpload('Photos must be JPEG, PNG, GIF or WebP images')
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        raise UploadTooLarge(f'Photos may be at most {self.max_bytes} bytes')
+                    digest.update(chunk)
+                    f.write(chunk)
+                f.flush()
+                os.fsync(f.fileno())
+            if ext is None:
+                raise UnsupportedUpload('Empty photo')
+            name = f'{digest.hexdigest()}.{ext}'
+            try:
+                # Atomic create-if-absent: identical uploads racing each
+                # other end up sharing one file
+                os.link(tmp_path, self.path(name))
+            except FileExistsError:
+                pass
+            return name
+        finally:
+            os.remove(tmp_path)
+
+    # ---------- post-processing ----------
+
+    def process_in_background(self, name: str):
+        """Queue EXIF stripping and thumbnailing unless the backlog is full"""
+        if not self._processable(name) or os.path.exists(self.thumbnail_path(name)):
+            return
+        with self._lock:
+            if name in self._pending:
+                return
+            if not self._slots.acquire(blocking=False):
+                return  # ensure_processed() will catch up on first use
+            self._pending.add(name)
+        self._pool.submit(self._process_queued, name)
+
+    def ensure_processed(self, name: str):
+        """Run post-processing now if it hasn't happened (or failed) yet"""
+        if self._processable(name) and not os.path.exists(self.thumbnail_path(name)):
+            self._try_process(name)
+
+    def _processable(self, name: str) -> bool:
+        return Image is not None and _pillow_format(name) is not None and name not in self._failed
+
+    def _process_queued(self, name: str):
+        try:
+            self._try_process(name)
+        finally:
+            with self._lock:
+                self._pending.discard(name)
+            self._slots.release()
+
+    def _try_process(self, name: str):
+        try:
+            self.process(name)
+        except Exception:
+            # e.g. a truncated file Pillow can't decode; don't retry per request
+            self._failed.add(name)
+            logger.exception('Processing upload %s failed', name)
+
+    def process(self, name: str):
+        """Strip metadata from the stored photo and write its thumbnail"""
+        path = self.path(name)
+        thumb_path = self.thumbnail_path(name)
+        with Image.open(path) as image:
+            # Bake the orientation in before the EXIF block is dropped
+            ImageOps.exif_transpose(image, in_place=True)
+            if image.mode not in ('RGB', 'L'):
+                image = image.convert('RGB')
+            options = {}
+            if _pillow_format(name) == 'JPEG':
+                # Reuse the upload's own quantization tables where we can,
+                # so an ID photo loses no detail to re-encoding
+                options['quality'] = 'keep' if image.format == 'JPEG' else JPEG_QUALITY
+            # Keep the content-addressed name: it identifies what was
+            # uploaded, which is what deduplication compares against
+            clean_path = f'{path}.{uuid.uuid4().hex}.tmp'
+            image.save(clean_path, format=_pillow_format(name), **options)
+            os.replace(clean_path, path)
+            image.thumbnail(THUMBNAIL_SIZE)
+            tmp_thumb = f'{thumb_path}.{uuid.uuid4().hex}.tmp'
+            image.save(tmp_thumb, format='JPEG', quality=80)
+            os.replace(tmp_thumb, thumb_path)
+
+    def close(self, wait: bool = True):
+        """Stop the worker pool, optionally finishing queued work first"""
+        self._pool.shutdown(wait=wait)
+
+
+def _pillow_format(name: str) -> Optional[str]:
+    """Pillow's name for the stored format; None for ones it can't read (HEIC)"""
+    ext = os.path.splitext(name)[1].lstrip('.')
+    return {'jpg': 'JPEG', 'png': 'PNG', 'gif': 'GIF', 'webp': 'WEBP'}.get(ext)
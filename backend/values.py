@@ -0,0 +1,40 @@
+"""Typed readings of the string values stored in the CSV columns.
+
+Everything in the tables is a string, often typed in by hand: pay as
+"$12,450", square footage as "1,200 sq ft", timestamps as ISO strings with
+or without a time part. These helpers turn them into comparable numbers
+and return None for anything they can't read.
+"""
+import re
+from datetime import datetime
+from typing import Callable, Dict, Optional
+
+_NUMBER_RE = re.compile(r'-?\d+(?:\.\d+)?')
+
+
+def parse_number(value) -> Optional[float]:
+    """First number in ``value``, ignoring currency signs and separators"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = _NUMBER_RE.search(str(value).replace(',', ''))
+    return float(match.group()) if match else None
+
+
+def parse_timestamp(value) -> Optional[float]:
+    """POSIX timestamp of an ISO 8601 date or datetime string"""
+    if not value:
+        return None
+    text = str(value).strip()
+    if text.endswith('Z'):
+        text = text[:-1] + '+00:00'
+    try:
+        return datetime.fromisoformat(text).timestamp()
+    except ValueError:
+        return None
+
+
+def typed_column(field: str, parse: Callable[[object], Optional[float]]) -> Callable[[Dict], Optional[float]]:
+    """Row -> parsed value of ``field``, e.g. as a store.SortedIndex value"""
+    return lambda row: parse(row.get(field))
@@ -0,0 +1,113 @@
+"""Single writer thread with group commit.
+
+Handlers used to do read -> modify -> write on their own request thread, so
+two concurrent assign_job calls could each rewrite the table and one update
+was silently lost. Now every mutation is a function handed to
+CommitQueue.submit(). One writer thread runs them in arrival order inside a
+single storage batch: the batch holds the cross-process writer lock (or a
+SQLite transaction), each function sees every earlier write, and the whole
+batch becomes durable with one commit before any caller gets its result.
+"""
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Iterable, Optional
+
+from metrics import COMMIT_BATCH_SIZE, COMMIT_SECONDS, COMMIT_WAIT_SECONDS
+
+# How long the writer lingers for more mutations before committing a batch
+DEFAULT_WINDOW = float(os.environ.get('APEX_COMMIT_WINDOW_MS', 1)) / 1000
+DEFAULT_MAX_BATCH = 256
+
+_STOP = object()
+
+
+class CommitQueue:
+    """Serializes mutations through one writer thread, committing in batches"""
+
+    def __init__(self, begin: Callable, tables: Iterable = (),
+                 window: float = DEFAULT_WINDOW, max_batch: int = DEFAULT_MAX_BATCH):
+        self._begin = begin
+        self._tables = list(tables)
+        self.window = window
+        self.max_batch = max_batch
+        self._queue: queue.Queue = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+
+    def submit(self, fn: Callable, *args, **kwargs):
+        """Run ``fn`` on the writer thread; returns its result once committed
+        and re-raises whatever it raised."""
+        if threading.current_thread() is self._thread:
+            return fn(*args, **kwargs)  # already inside a batch
+        self._ensure_started()
+        future: Future = Future()
+        self._queue.put((fn, args, kwargs, future, time.perf_counter()))
+        return future.result()
+
+    def close(self, timeout: Optional[float] = None):
+        """Commit everything already submitted, then stop the writer"""
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='commit-writer', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            batch = [item]
+            stop = False
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+            self._commit(batch)
+            if stop:
+                return
+
+    def _commit(self, batch):
+        outcomes = []
+        started = time.perf_counter()
+        COMMIT_BATCH_SIZE.observe(len(batch))
+        for _, _, _, _, submitted in batch:
+            COMMIT_WAIT_SECONDS.observe(started - submitted)
+        try:
+            with self._begin():
+                for fn, args, kwargs, future, _ in batch:
+                    try:
+                        outcomes.append((future, fn(*args, **kwargs), None))
+                    except Exception as e:
+                        outcomes.append((future, None, e))
+        except Exception as e:
+            # The commit itself failed: nothing in this batch is durable and
+            # resident tables may hold rows that never reached the disk
+            for table in self._tables:
+                table.invalidate()
+            for _, _, _, future, _ in batch:
+                future.set_exception(e)
+            return
+        finally:
+            COMMIT_SECONDS.observe(time.perf_counter() - started)
+        for future, result, error in outcomes:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
@@ -80,21 +80,18 @@ export function AuthProvider({ children }: { children: React.ReactNode }) {
             // Skip profileID fetch for demo logins to speed up
             if (!isDemoLogin) {
                 // Try to get profileID from API if available (non-blocking, fire and forget)
-                fetch(`${API_BASE_URL}/profiles`)
+                fetch(`${API_BASE_URL}/profiles?email=${encodeURIComponent(email)}`)
                     .then(response => {
                         if (response.ok) {
                             return response.json();
                         }
                         return null;
                     })
-                    .then(profiles => {
-                        if (profiles) {
-                            const profile = profiles.find((p: any) => p.email === email);
-                            if (profile && user) {
-                                user.profileID = profile.profileID;
-                                setCurrentUser(user);
-                                sessionStorage.setItem('currentUser', JSON.stringify(user));
-                            }
+                    .then(profile => {
+                        if (profile && user) {
+                            user.profileID = profile.profileID;
+                            setCurrentUser(user);
+                            sessionStorage.setItem('currentUser', JSON.stringify(user));
                         }
                     })
                     .catch(() => {
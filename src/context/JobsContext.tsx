@@ -121,10 +121,41 @@ export function JobsProvider({ children }: { children: React.ReactNode }) {
     }
   }, []);
 
-  // Load jobs on mount
+  // Merge a single job pushed by the server into local state
+  const upsertLocalJob = useCallback((apiJob: any) => {
+    const job = convertApiJobToCustomerJob(apiJob);
+    setJobs(prevJobs => {
+      const index = prevJobs.findIndex(j => j.id === job.id);
+      if (index === -1) return [...prevJobs, job];
+      const next = prevJobs.slice();
+      next[index] = job;
+      return next;
+    });
+  }, []);
+
+  // Drop a job the server no longer lists (e.g. moved to the archive)
+  const removeLocalJob = useCallback((apiJob: any) => {
+    const jobId = apiJob.jobID || apiJob.id;
+    setJobs(prevJobs => prevJobs.filter(j => j.id !== jobId));
+  }, []);
+
+  // Load jobs on mount, then follow the server's change stream instead of refetching
   useEffect(() => {
     refreshJobs();
-  }, [refreshJobs]);
+
+    const source = new EventSource(`${API_BASE_URL}/jobs/stream`);
+    source.addEventListener('job', (event) => {
+      upsertLocalJob(JSON.parse((event as MessageEvent).data));
+    });
+    source.addEventListener('remove', (event) => {
+      removeLocalJob(JSON.parse((event as MessageEvent).data));
+    });
+    // The server lost track of what we have seen: fall back to a full reload
+    source.addEventListener('reset', () => {
+      refreshJobs();
+    });
+    return () => source.close();
+  }, [refreshJobs, upsertLocalJob, removeLocalJob]);
 
   const createJob = async (jobData: Omit<CustomerJob, 'id' | 'createdAt' | 'status'> & { assignedContractorId?: string | number }): Promise<CustomerJob> => {
     try {
@@ -158,8 +189,7 @@ export function JobsProvider({ children }: { children: React.ReactNode }) {
       const newJob = convertApiJobToCustomerJob(result.job);
       
       // Backend already handles contractor assignment if assignedContractorId was provided
-      // Refresh jobs list to get the latest state
-      await refreshJobs();
+      upsertLocalJob(result.job);
       
       return newJob;
     } catch (err: any) {
@@ -196,8 +226,8 @@ export function JobsProvider({ children }: { children: React.ReactNode }) {
         throw new Error(errorData.error || 'Failed to update job');
       }
 
-      // Refresh jobs list
-      await refreshJobs();
+      const result = await response.json();
+      upsertLocalJob(result.job);
     } catch (err: any) {
       console.error('Error updating job:', err);
       // Only throw if it's not a "not found" error
@@ -246,9 +276,9 @@ export function JobsProvider({ children }: { children: React.ReactNode }) {
         throw new Error(errorData.error || 'Failed to assign contractor');
       }
 
-      // Refresh jobs from server to get the updated state
       // The backend has already updated the job status
-      await refreshJobs();
+      const result = await response.json();
+      upsertLocalJob(result.job);
     } catch (err: any) {
       console.error('Error assigning contractor:', err);
       throw err;